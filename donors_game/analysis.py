@@ -0,0 +1,261 @@
+import json
+import os
+from typing import Dict, List, Tuple, Union
+import numpy as np
+from utils.run_log import load_game_state
+
+# one row per decision; donor and recipient are indices into RunFrame.names
+COLUMNS = {
+    "run": np.int32,
+    "generation": np.int32,
+    "round": np.int32,
+    "donor": np.int32,
+    "recipient": np.int32,
+    "donation_percent": np.float64,
+    "donation_amount": np.float64,
+    "donor_wallet_before": np.float64,
+    "donor_wallet_after": np.float64,
+    "fallback": np.bool_,
+    "raw_donation_percent": np.float64,
+}
+
+REDUCERS = ("sum", "mean", "max", "min", "count")
+
+
+class RunFrame:
+    """
+    Every decision of one or more runs as flat numpy columns (see COLUMNS),
+    with `runs` holding each run's path and config. Metrics are group-bys over
+    these columns instead of loops over the nested game_state.json layout.
+    """
+
+    def __init__(
+        self, columns: Dict[str, np.ndarray], names: np.ndarray, runs: List[dict]
+    ):
+        self.columns = columns
+        self.names = names
+        self.runs = runs
+
+    def __len__(self) -> int:
+        return len(self.columns["run"])
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self.columns[column]
+
+    def group_by(
+        self, keys: List[str], **aggregations: Tuple[Union[str, np.ndarray], str]
+    ) -> Dict[str, np.ndarray]:
+        """
+        One row per distinct combination of `keys`, sorted by them. Each
+        aggregation maps an output name to (column, reducer), where reducer is
+        one of REDUCERS, e.g. `total=("donor_wallet_before", "sum")`. The
+        column can also be an array aligned with the frame's rows.
+        """
+        if not len(self):
+            return {
+                **{key: np.empty(0, COLUMNS[key]) for key in keys},
+                **{name: np.empty(0) for name in aggregations},
+            }
+        groups, first, inverse = np.unique(
+            np.stack([self.columns[key] for key in keys], axis=1),
+            axis=0,
+            return_index=True,
+            return_inverse=True,
+        )
+        inverse = inverse.reshape(-1)
+        counts = np.bincount(inverse, minlength=len(groups))
+        result = {key: groups[:, i] for i, key in enumerate(keys)}
+        for name, (column, reducer) in aggregations.items():
+            values = self.columns[column] if isinstance(column, str) else column
+            if reducer == "count":
+                result[name] = counts
+            elif reducer in ("sum", "mean"):
+                sums = np.bincount(inverse, weights=values, minlength=len(groups))
+                result[name] = sums if reducer == "sum" else sums / counts
+            elif reducer in ("max", "min"):
+                ufunc = np.maximum if reducer == "max" else np.minimum
+                reduced = values[first].astype(np.float64)
+                ufunc.at(reduced, inverse, values)
+                result[name] = reduced
+            else:
+                raise ValueError(f"Unknown reducer {reducer}, expected one of {REDUCERS}")
+        return result
+
+    @classmethod
+    def concat(cls, frames: List["RunFrame"]) -> "RunFrame":
+        """Stacks frames, renumbering runs and re-interning names."""
+        names: Dict[str, int] = {}
+        columns: Dict[str, List[np.ndarray]] = {column: [] for column in COLUMNS}
+        runs = []
+        for frame in frames:
+            name_ids = np.array(
+                [names.setdefault(name, len(names)) for name in frame.names],
+                dtype=np.int32,
+            )
+            for column in COLUMNS:
+                values = frame.columns[column]
+                if column == "run":
+                    values = values + len(runs)
+                elif column in ("donor", "recipient"):
+                    values = name_ids[values] if len(values) else values
+                columns[column].append(values)
+            runs.extend(frame.runs)
+        return cls(
+            {
+                column: np.concatenate(values) if values else np.empty(0, COLUMNS[column])
+                for column, values in columns.items()
+            },
+            np.array(list(names), dtype=str),
+            runs,
+        )
+
+
+def frame_from_game_state(data: dict, path: str = "") -> RunFrame:
+    """Flattens a run in the game_state.json layout (as returned by load_game_state)."""
+    names: Dict[str, int] = {}
+    decisions = [
+        decision
+        for generation_key in sorted(data["history"], key=lambda key: int(key[1:]))
+        for player in data["history"][generation_key]
+        for decision in player["history"]
+    ]
+    columns = {
+        "run": np.zeros(len(decisions), np.int32),
+        "generation": np.array(
+            [decision["dynamic_game_state"]["generation"] for decision in decisions],
+            np.int32,
+        ),
+        "round": np.array(
+            [decision["dynamic_game_state"]["round"] for decision in decisions],
+            np.int32,
+        ),
+        "donor": np.array(
+            [names.setdefault(decision["donor_name"], len(names)) for decision in decisions],
+            np.int32,
+        ),
+        "recipient": np.array(
+            [names.setdefault(decision["recipient_name"], len(names)) for decision in decisions],
+            np.int32,
+        ),
+    }
+    for column in (
+        "donation_percent",
+        "donation_amount",
+        "donor_wallet_before",
+        "donor_wallet_after",
+    ):
+        columns[column] = np.array(
+            [decision[column] for decision in decisions], np.float64
+        )
+    columns["fallback"] = np.array(
+        [decision.get("fallback", False) for decision in decisions], np.bool_
+    )
+    # runs from before repairs recorded the answer itself as the percentage
+    columns["raw_donation_percent"] = np.array(
+        [
+            decision["donation_percent"]
+            if decision.get("raw_donation_percent") is None
+            else decision["raw_donation_percent"]
+            for decision in decisions
+        ],
+        np.float64,
+    )
+    config = {key: value for key, value in data.items() if key != "history"}
+    return RunFrame(columns, np.array(list(names), dtype=str), [{"path": path, **config}])
+
+
+def frame_cache_path(path: str) -> str:
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, ".frames", filename + ".npz")
+
+
+def load_run(path: str, cache: bool = True) -> RunFrame:
+    """
+    Loads a saved run (json snapshot or .jsonl run log) as a RunFrame. With
+    `cache` the frame is kept in a .frames/<file>.npz next to the run and
+    reused for as long as the run file's mtime and size are unchanged.
+    """
+    stat = os.stat(path)
+    stamp = np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+    cache_path = frame_cache_path(path)
+    if cache and os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            # frames cached before a column was added are rebuilt
+            if np.array_equal(cached["stamp"], stamp) and all(
+                column in cached for column in COLUMNS
+            ):
+                return RunFrame(
+                    {column: cached[column] for column in COLUMNS},
+                    cached["names"],
+                    [json.loads(str(cached["run_config"]))],
+                )
+
+    frame = frame_from_game_state(load_game_state(path), path)
+    if cache:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                stamp=stamp,
+                names=frame.names,
+                run_config=np.array(json.dumps(frame.runs[0])),
+                **frame.columns,
+            )
+        os.replace(tmp_path, cache_path)
+    return frame
+
+
+def load_runs(paths: List[str], cache: bool = True) -> RunFrame:
+    """Loads many runs into one frame, with the `run` column indexing `frame.runs`."""
+    return RunFrame.concat([load_run(path, cache=cache) for path in paths])
+
+
+def round_metrics(frame: RunFrame) -> Dict[str, np.ndarray]:
+    """Per run, generation and round: total and max wallet, average and max donation percentage."""
+    return frame.group_by(
+        ["run", "generation", "round"],
+        total_wallet=("donor_wallet_before", "sum"),
+        max_wallet=("donor_wallet_before", "max"),
+        average_donation_percent=("donation_percent", "mean"),
+        max_donation_percent=("donation_percent", "max"),
+    )
+
+
+def generation_metrics(frame: RunFrame) -> Dict[str, np.ndarray]:
+    """Per run and generation: average donation percentage and the number of donations over 100%."""
+    return frame.group_by(
+        ["run", "generation"],
+        average_donation_percent=("donation_percent", "mean"),
+        donations_over_one=(frame["raw_donation_percent"] > 1, "sum"),
+    )
+
+
+def by_generation(
+    metrics: Dict[str, np.ndarray], value: str, run: int = 0
+) -> np.ndarray:
+    """
+    A (generations, rounds) array of one round metric for one run, NaN where a
+    round is missing. Columns are rounds in order from each generation's first
+    round (generation 0 starts at round 0, later ones at round 1).
+    """
+    rows = metrics["run"] == run
+    generations = metrics["generation"][rows]
+    rounds = metrics["round"][rows]
+    first_round = np.full(generations.max() + 1, rounds.max())
+    np.minimum.at(first_round, generations, rounds)
+    offsets = rounds - first_round[generations]
+    grid = np.full((generations.max() + 1, offsets.max() + 1), np.nan)
+    grid[generations, offsets] = metrics[value][rows]
+    return grid
+
+
+def find_runs(root: str = "data", filename: str = "game_state.json") -> List[str]:
+    """Every saved run under `root`, e.g. for a dashboard over a whole sweep."""
+    paths = []
+    for directory, subdirectories, filenames in os.walk(root):
+        # skip caches such as .frames and .cache
+        subdirectories[:] = [name for name in subdirectories if not name.startswith(".")]
+        if filename in filenames:
+            paths.append(os.path.join(directory, filename))
+    return sorted(paths)
@@ -0,0 +1,329 @@
+import argparse
+import json
+import os
+from typing import Dict, List, Optional
+import numpy as np
+from analysis import COLUMNS, RunFrame, find_runs, frame_from_game_state
+from utils.run_log import load_game_state
+
+# Fixed-width little-endian records, appended run after run. Decisions of a run are
+# sorted by generation and round, and INDEX has one row per (run, generation, round)
+# with the decision rows [start, stop). Names and strategies are ids into the string
+# heap: strings.bin holds their utf-8 bytes, string i spanning offsets[i]:offsets[i + 1].
+DECISION_DTYPE = np.dtype(
+    [
+        ("run", "<i4"),
+        ("generation", "<i4"),
+        ("round", "<i4"),
+        ("donor", "<i4"),
+        ("recipient", "<i4"),
+        ("donation_percent", "<f8"),
+        ("donation_amount", "<f8"),
+        ("donor_wallet_before", "<f8"),
+        ("donor_wallet_after", "<f8"),
+        ("fallback", "u1"),
+        ("raw_donation_percent", "<f8"),
+    ]
+)
+INDEX_DTYPE = np.dtype(
+    [
+        ("run", "<i4"),
+        ("generation", "<i4"),
+        ("round", "<i4"),
+        ("start", "<i8"),
+        ("stop", "<i8"),
+    ]
+)
+# each generation's roster as saved at its end
+PLAYER_DTYPE = np.dtype(
+    [
+        ("run", "<i4"),
+        ("generation", "<i4"),
+        ("name", "<i4"),
+        ("strategy", "<i4"),
+        ("wallet", "<f8"),
+    ]
+)
+TABLES = {
+    "decisions": DECISION_DTYPE,
+    "index": INDEX_DTYPE,
+    "players": PLAYER_DTYPE,
+    "offsets": np.dtype("<i8"),
+    "strings": np.dtype("u1"),
+}
+
+
+def table_path(path: str, table: str) -> str:
+    return os.path.join(path, f"{table}.bin")
+
+
+def manifest_path(path: str) -> str:
+    return os.path.join(path, "manifest.json")
+
+
+def read_manifest(path: str) -> dict:
+    if not os.path.exists(manifest_path(path)):
+        return {
+            "runs": [],
+            "counts": {table: 0 for table in TABLES},
+            "decision_fields": list(DECISION_DTYPE.names),
+        }
+    with open(manifest_path(path), "r") as f:
+        manifest = json.load(f)
+    # rows are fixed-width, so tables written with other fields can't be read or appended to
+    if manifest.get("decision_fields") != list(DECISION_DTYPE.names):
+        raise ValueError(f"{path} was written with other decision fields, rebuild it")
+    return manifest
+
+
+def mapped(path: str, table: str, count: int) -> np.ndarray:
+    # numpy can't map an empty file
+    if not count:
+        return np.empty(0, TABLES[table])
+    return np.memmap(table_path(path, table), dtype=TABLES[table], mode="r", shape=(count,))
+
+
+class ArchiveWriter:
+    """
+    Appends saved runs to an archive directory. Tables are only appended to,
+    and manifest.json, rewritten last, records how many rows of each are
+    committed, so a writer that dies part way leaves the archive as it was.
+    One writer at a time.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.manifest = read_manifest(path)
+        counts = self.manifest["counts"]
+        for table, dtype in TABLES.items():
+            # drop rows appended after the last commit
+            with open(table_path(path, table), "ab") as f:
+                f.truncate(counts[table] * dtype.itemsize)
+        offsets = mapped(path, "offsets", counts["offsets"])
+        heap = mapped(path, "strings", counts["strings"])
+        self.string_ids: Dict[str, int] = {
+            bytes(heap[offsets[i] : offsets[i + 1]]).decode(): i
+            for i in range(len(offsets) - 1)
+        }
+        self.heap_size = int(offsets[-1]) if len(offsets) else 0
+        self.new_strings: List[bytes] = []
+        self.new_offsets: List[int] = [] if len(offsets) else [0]
+        self.sources = {
+            (run["path"], tuple(run["stamp"])): i
+            for i, run in enumerate(self.manifest["runs"])
+        }
+
+    def intern(self, string: str) -> int:
+        if string not in self.string_ids:
+            encoded = string.encode()
+            self.string_ids[string] = len(self.string_ids)
+            self.new_strings.append(encoded)
+            self.heap_size += len(encoded)
+            self.new_offsets.append(self.heap_size)
+        return self.string_ids[string]
+
+    def add_run(self, path: str) -> int:
+        """
+        Archives a saved run (json snapshot or .jsonl run log) and returns its
+        run id. A file already archived with the same mtime and size is skipped.
+        """
+        stat = os.stat(path)
+        source = (os.path.relpath(path, self.path), (stat.st_mtime_ns, stat.st_size))
+        if source in self.sources:
+            return self.sources[source]
+        run = len(self.manifest["runs"])
+        data = load_game_state(path)
+        frame = frame_from_game_state(data, path)
+        name_ids = np.array([self.intern(str(name)) for name in frame.names], np.int32)
+
+        order = np.lexsort((frame["round"], frame["generation"]))
+        decisions = np.empty(len(order), DECISION_DTYPE)
+        for column in COLUMNS:
+            values = frame[column][order]
+            if column == "run":
+                values = np.full(len(order), run)
+            elif column in ("donor", "recipient") and len(values):
+                values = name_ids[values]
+            decisions[column] = values
+
+        keys = np.stack([decisions["generation"], decisions["round"]], axis=1)
+        starts = np.flatnonzero(
+            np.concatenate([[True], np.any(keys[1:] != keys[:-1], axis=1)])
+        ) if len(keys) else np.empty(0, np.int64)
+        stops = np.append(starts[1:], len(decisions))
+        offset = self.manifest["counts"]["decisions"]
+        index = np.empty(len(starts), INDEX_DTYPE)
+        index["run"] = run
+        index["generation"] = decisions["generation"][starts]
+        index["round"] = decisions["round"][starts]
+        index["start"] = starts + offset
+        index["stop"] = stops + offset
+
+        rosters = [
+            (int(generation_key[1:]), player)
+            for generation_key, players in data["history"].items()
+            for player in players
+        ]
+        players = np.empty(len(rosters), PLAYER_DTYPE)
+        players["run"] = run
+        players["generation"] = [generation for generation, _ in rosters]
+        players["name"] = [self.intern(player["name"]) for _, player in rosters]
+        players["strategy"] = [self.intern(player["strategy"]) for _, player in rosters]
+        players["wallet"] = [player["wallet"] for _, player in rosters]
+
+        self.append("decisions", decisions)
+        self.append("index", index)
+        self.append("players", players)
+        self.append("offsets", np.array(self.new_offsets, TABLES["offsets"]))
+        self.append("strings", np.frombuffer(b"".join(self.new_strings), TABLES["strings"]))
+        self.new_strings, self.new_offsets = [], []
+
+        config = {key: value for key, value in data.items() if key not in ("history", "decisions")}
+        self.manifest["runs"].append(
+            {"path": source[0], "stamp": list(source[1]), "config": config}
+        )
+        self.sources[source] = run
+        self.commit()
+        return run
+
+    def append(self, table: str, rows: np.ndarray):
+        with open(table_path(self.path, table), "ab") as f:
+            rows.tofile(f)
+        self.manifest["counts"][table] += len(rows)
+
+    def commit(self):
+        tmp_path = manifest_path(self.path) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, manifest_path(self.path))
+
+
+class Archive:
+    """
+    Read side of an archive. Tables are memory-mapped, so a query over a
+    generation and round of many runs reads only the index and those rounds'
+    decision rows.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        manifest = read_manifest(path)
+        self.runs: List[dict] = manifest["runs"]
+        counts = manifest["counts"]
+        self.decisions = mapped(path, "decisions", counts["decisions"])
+        self.index = mapped(path, "index", counts["index"])
+        self.players = mapped(path, "players", counts["players"])
+        self.offsets = mapped(path, "offsets", counts["offsets"])
+        self.heap = mapped(path, "strings", counts["strings"])
+
+    def string(self, i: int) -> str:
+        return bytes(self.heap[self.offsets[i] : self.offsets[i + 1]]).decode()
+
+    def find(self, **config) -> np.ndarray:
+        """Ids of the runs whose config has all the given values, e.g. `find(donation_multiplier=2)`."""
+        return np.array(
+            [
+                run
+                for run, entry in enumerate(self.runs)
+                if all(entry["config"].get(key) == value for key, value in config.items())
+            ],
+            np.int32,
+        )
+
+    def rounds(
+        self,
+        runs: Optional[np.ndarray] = None,
+        generation: Optional[int] = None,
+        round: Optional[int] = None,
+    ) -> np.ndarray:
+        """Index rows of the matching rounds."""
+        index = np.asarray(self.index)
+        mask = np.ones(len(index), bool)
+        if runs is not None:
+            mask &= np.isin(index["run"], runs)
+        if generation is not None:
+            mask &= index["generation"] == generation
+        if round is not None:
+            mask &= index["round"] == round
+        return index[mask]
+
+    def select(
+        self,
+        runs: Optional[np.ndarray] = None,
+        generation: Optional[int] = None,
+        round: Optional[int] = None,
+    ) -> np.ndarray:
+        """Decision records of the matching rounds, reading only their rows."""
+        rounds = self.rounds(runs, generation, round)
+        if not len(rounds):
+            return np.empty(0, DECISION_DTYPE)
+        return np.concatenate(
+            [self.decisions[start:stop] for start, stop in zip(rounds["start"], rounds["stop"])]
+        )
+
+    def round_means(
+        self,
+        column: str,
+        generation: int,
+        round: int,
+        runs: Optional[np.ndarray] = None,
+    ) -> Dict[str, np.ndarray]:
+        """Per run, the mean of a decision column in one round, e.g. round 1 of generation 5 over a sweep."""
+        rounds = self.rounds(runs, generation, round)
+        return {
+            "run": rounds["run"],
+            column: np.array(
+                [
+                    self.decisions[column][start:stop].mean()
+                    for start, stop in zip(rounds["start"], rounds["stop"])
+                ]
+            ),
+        }
+
+    def strategies(self, run: int, generation: int) -> Dict[str, str]:
+        players = np.asarray(self.players)
+        rows = players[(players["run"] == run) & (players["generation"] == generation)]
+        return {self.string(row["name"]): self.string(row["strategy"]) for row in rows}
+
+    def frame(
+        self,
+        runs: Optional[np.ndarray] = None,
+        generation: Optional[int] = None,
+        round: Optional[int] = None,
+    ) -> RunFrame:
+        """The matching decisions as a RunFrame, for the metrics in analysis.py. `run` keeps the archive's run ids."""
+        decisions = self.select(runs, generation, round)
+        ids, players = np.unique(
+            np.concatenate([decisions["donor"], decisions["recipient"]]), return_inverse=True
+        )
+        players = players.reshape(-1).astype(np.int32)
+        columns = {column: decisions[column].astype(dtype) for column, dtype in COLUMNS.items()}
+        columns["donor"] = players[: len(decisions)]
+        columns["recipient"] = players[len(decisions) :]
+        names = np.array([self.string(i) for i in ids], dtype=str)
+        return RunFrame(
+            columns,
+            names,
+            [{"path": entry["path"], **entry["config"]} for entry in self.runs],
+        )
+
+
+if __name__ == "__main__":
+    # python archive.py ../data/archive ../data
+    parser = argparse.ArgumentParser(description="Append saved runs to a memory-mapped archive")
+    parser.add_argument("archive")
+    parser.add_argument("paths", nargs="+", help="run files, or directories searched for game_state.json")
+    args = parser.parse_args()
+
+    writer = ArchiveWriter(args.archive)
+    before = len(writer.manifest["runs"])
+    for path in args.paths:
+        for run_path in find_runs(path) if os.path.isdir(path) else [path]:
+            run = writer.add_run(run_path)
+            print(f"{run}: {run_path}")
+    counts = writer.manifest["counts"]
+    print(
+        f"{len(writer.manifest['runs']) - before} new runs, {len(writer.manifest['runs'])} in total, "
+        f"{counts['decisions']} decisions, {counts['strings']} bytes of strings"
+    )
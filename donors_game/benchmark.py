@@ -0,0 +1,380 @@
+import os
+
+# the fake LLM never reaches the network, and exporting spans would be measured too
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("DONORS_GAME_TELEMETRY", "off")
+
+import argparse
+import asyncio
+import builtins
+import hashlib
+import itertools
+import json
+import multiprocessing
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager, suppress
+from typing import Dict, List
+from models.config import GameState
+from models.signatures import StrategyBuilder, DonationBuilder, DonationBatchBuilder, DonorDonation
+import game.policies
+from game.orchestrator import Orchestrator
+from game.player import Player
+from utils.api import async_parse, configure_async_client, configure_llm_budget
+
+STAGES = ("spawn", "pairs", "prompts", "play_round", "save_state", "evolve")
+# entry points that must import quickly, e.g. in every sweep worker
+IMPORT_MODULES = ("game.orchestrator", "sweep", "analysis")
+# only loaded once a client or exporter is actually needed
+LAZY_MODULES = ("openai", "opentelemetry.sdk.trace")
+
+
+class FakeLLM:
+    """
+    Stands in for `structured_generation_wrapper`: answers every structured
+    call after `latency` seconds with a value derived from a hash of the
+    messages, so the benchmark measures the engine and not the model.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def value(self, kwargs: dict) -> float:
+        digest = hashlib.sha256(json.dumps(kwargs["messages"]).encode()).digest()
+        return int.from_bytes(digest[:8], "big") / 2**64
+
+    def respond(self, kwargs: dict):
+        self.calls += 1
+        response_format = kwargs["response_format"]
+        value = self.value(kwargs)
+        if response_format is StrategyBuilder:
+            return StrategyBuilder(
+                thoughts=["benchmark"],
+                strategy=f"My strategy will be to donate {value:.2f} of my resources.",
+            )
+        if response_format is DonationBatchBuilder:
+            prompt = kwargs["messages"][-1]["content"]
+            donors = [
+                line[len("Donor ") : -1]
+                for line in prompt.splitlines()
+                if line.startswith("Donor ") and line.endswith(":")
+            ]
+            return DonationBatchBuilder(
+                donations=[
+                    DonorDonation(donor_name=donor, thoughts=["benchmark"], donation=value)
+                    for donor in donors
+                ]
+            )
+        return DonationBuilder(thoughts=["benchmark"], donation=value)
+
+    def __call__(self, *args, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.respond(kwargs)
+
+    async def acall(self, *args, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.respond(kwargs)
+
+
+def install_fake_llm(fake: FakeLLM):
+    game.policies.structured_generation_wrapper = fake
+    game.policies.async_structured_generation_wrapper = fake.acall
+
+
+@contextmanager
+def quiet():
+    # the engine prints every strategy and donation
+    original_print = builtins.print
+    builtins.print = lambda *args, **kwargs: None
+    try:
+        yield
+    finally:
+        builtins.print = original_print
+
+
+class StageTimer:
+    def __init__(self):
+        self.seconds: Dict[str, float] = defaultdict(float)
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+
+
+def play(game_state: GameState, timer: StageTimer) -> int:
+    """Plays a full game like `Orchestrator.run`, timing each stage. Returns the number of decisions."""
+    with timer.stage("spawn"):
+        orchestrator = Orchestrator(game_state)
+    decisions = 0
+    for _ in range(game_state.generations):
+        for _ in range(game_state.rounds):
+            time_prompts(orchestrator, timer)
+            with timer.stage("play_round"):
+                orchestrator.play_round()
+            decisions += len(orchestrator.last_round_decisions)
+            with timer.stage("save_state"):
+                orchestrator.save_state()
+        finish_generation(orchestrator, timer)
+        if game_state.generation < game_state.generations:
+            with timer.stage("evolve"):
+                orchestrator.evolve()
+    return decisions
+
+
+async def aplay(game_state: GameState, timer: StageTimer) -> int:
+    """Async engine counterpart of `play`, following `Orchestrator.arun`."""
+    with timer.stage("spawn"):
+        orchestrator = Orchestrator(game_state)
+        configure_async_client(max_concurrency=game_state.max_concurrency)
+        orchestrator.players = await Player.aspawn(
+            game_state=game_state,
+            count=game_state.players,
+            decision_table=orchestrator.decision_table,
+        )
+    decisions = 0
+    for _ in range(game_state.generations):
+        for _ in range(game_state.rounds):
+            time_prompts(orchestrator, timer)
+            with timer.stage("play_round"):
+                await orchestrator.aplay_round()
+            decisions += len(orchestrator.last_round_decisions)
+            with timer.stage("save_state"):
+                orchestrator.save_state()
+        finish_generation(orchestrator, timer)
+        if game_state.generation < game_state.generations:
+            with timer.stage("evolve"):
+                await orchestrator.aevolve()
+    return decisions
+
+
+def time_prompts(orchestrator: Orchestrator, timer: StageTimer):
+    # pairing and prompt building in isolation; play_round repeats both
+    with timer.stage("pairs"):
+        pairs = orchestrator.create_donor_recipient_pairs()
+    with timer.stage("prompts"):
+        for donor, recipient in pairs:
+            donor.donation_args(orchestrator.game_state, recipient)
+
+
+def finish_generation(orchestrator: Orchestrator, timer: StageTimer):
+    with timer.stage("save_state"):
+        if orchestrator.rounds_since_snapshot:
+            orchestrator.save_snapshot()
+
+
+def play_game(game_state: GameState, timer: StageTimer) -> int:
+    if game_state.engine == "async":
+        return asyncio.run(aplay(game_state, timer))
+    return play(game_state, timer)
+
+
+def run_case(case: dict, measure_memory: bool = True) -> dict:
+    """
+    Times one configuration, then plays it again under tracemalloc for its
+    peak memory, so tracing overhead doesn't skew the timings.
+    """
+    game_state_args = {
+        "model_name": "benchmark",
+        "policy": "llm",
+        **case,
+    }
+    timer = StageTimer()
+    start = time.perf_counter()
+    with quiet():
+        decisions = play_game(GameState(**game_state_args), timer)
+    elapsed = time.perf_counter() - start
+    result = {
+        "decisions": decisions,
+        "seconds": elapsed,
+        "decisions_per_second": decisions / timer.seconds["play_round"]
+        if timer.seconds["play_round"]
+        else None,
+        "stages": {stage: timer.seconds[stage] for stage in STAGES},
+    }
+    if measure_memory:
+        tracemalloc.start()
+        with quiet():
+            play_game(GameState(**game_state_args), StageTimer())
+        result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def import_time(module: str, repeats: int = 3) -> dict:
+    """
+    Best of `repeats` fresh interpreters importing `module` without
+    OPENAI_API_KEY set, and which of LAZY_MODULES the import loaded anyway.
+    """
+    env = {key: value for key, value in os.environ.items() if key != "OPENAI_API_KEY"}
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "seconds = time.perf_counter() - start\n"
+        f"print(json.dumps([seconds, [name for name in {LAZY_MODULES!r} if name in sys.modules]]))"
+    )
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+    return {"seconds": min(seconds for seconds, _ in runs), "loaded": runs[0][1]}
+
+
+def check_imports(budget: float) -> List[str]:
+    """Entry points that import slower than `budget` seconds or load a lazy dependency."""
+    failures = []
+    for module in IMPORT_MODULES:
+        result = import_time(module)
+        print(f"import {module}: {result['seconds'] * 1000:.0f}ms")
+        if result["seconds"] > budget:
+            failures.append(f"import {module} took {result['seconds']:.3f}s, budget {budget}s")
+        for name in result["loaded"]:
+            failures.append(f"import {module} loaded {name}")
+    return failures
+
+
+async def cancel_budget_wait(budget) -> bool:
+    """Cancels a call waiting for the LLM budget, then checks the permit came back."""
+    configure_llm_budget(budget)
+    try:
+        budget.acquire()
+        waiting = asyncio.create_task(async_parse({}, {"latency": 0.0, "queue_wait": 0.0}))
+        await asyncio.sleep(0.1)
+        waiting.cancel()
+        # the cancelled call's thread takes the permit now
+        budget.release()
+        with suppress(asyncio.CancelledError):
+            await waiting
+        return await asyncio.to_thread(budget.acquire, True, 5)
+    finally:
+        configure_llm_budget(None)
+
+
+def check_budget() -> List[str]:
+    """LLM budget permits leaked by calls cancelled by a deadline or a hedge."""
+    with multiprocessing.Manager() as manager:
+        if asyncio.run(cancel_budget_wait(manager.BoundedSemaphore(1))):
+            return []
+    return ["a call cancelled while waiting for the LLM budget kept its permit"]
+
+
+def case_key(case: dict) -> str:
+    return ",".join(f"{key}={value}" for key, value in sorted(case.items()))
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """Stages (and peak memory) that got more than `tolerance` times slower (larger) than the baseline."""
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        before = baseline[key]
+        metrics = [(f"stages.{stage}", before["stages"].get(stage), result["stages"][stage]) for stage in STAGES]
+        metrics.append(("peak_memory_bytes", before.get("peak_memory_bytes"), result.get("peak_memory_bytes")))
+        for name, old, new in metrics:
+            # sub-millisecond stages are too noisy to compare
+            if old is None or new is None or (name.startswith("stages") and max(old, new) < 1e-3):
+                continue
+            if new > old * tolerance:
+                regressions.append(f"{key} {name}: {old:.4g} -> {new:.4g} ({new / old:.2f}x)")
+    return regressions
+
+
+if __name__ == "__main__":
+    # python benchmark.py --players 12 100 1000 --save-baseline ../data/benchmarks/baseline.json
+    # python benchmark.py --players 12 100 1000 --compare ../data/benchmarks/baseline.json
+    parser = argparse.ArgumentParser(description="Benchmark the game engine against a fake LLM")
+    parser.add_argument("--players", type=int, nargs="+", default=[12, 100, 1000, 10000])
+    parser.add_argument("--trace-depths", type=int, nargs="+", default=[3])
+    parser.add_argument("--generations", type=int, nargs="+", default=[2])
+    parser.add_argument("--rounds", type=int, default=4)
+    parser.add_argument("--engine", default="threads")
+    parser.add_argument("--donation-mode", default="individual")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake LLM latency in seconds")
+    parser.add_argument("--max-concurrency", type=int, default=16)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--output", help="write the results to this json file")
+    parser.add_argument("--save-baseline", help="write the results as the new baseline")
+    parser.add_argument("--compare", help="baseline to compare against, exits 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    parser.add_argument(
+        "--import-budget", type=float, default=0.5, help="seconds each entry point may take to import"
+    )
+    args = parser.parse_args()
+
+    failures = check_imports(args.import_budget)
+    for failure in failures:
+        print(f"SLOW IMPORT {failure}")
+    for failure in check_budget():
+        print(f"LEAK {failure}")
+        failures.append(failure)
+
+    install_fake_llm(FakeLLM(args.latency))
+    results = {}
+    # runs write their logs and snapshots under ../data, so keep them out of the real one
+    workdir = tempfile.TemporaryDirectory()
+    cwd = os.getcwd()
+    os.makedirs(os.path.join(workdir.name, "donors_game"))
+    os.chdir(os.path.join(workdir.name, "donors_game"))
+    try:
+        for players, trace_depth, generations in itertools.product(
+            args.players, args.trace_depths, args.generations
+        ):
+            case = {
+                "players": players,
+                "trace_depth": trace_depth,
+                "generations": generations,
+                "rounds": args.rounds,
+                "engine": args.engine,
+                "donation_mode": args.donation_mode,
+                "max_concurrency": args.max_concurrency,
+            }
+            result = run_case(case, measure_memory=not args.no_memory)
+            results[case_key(case)] = result
+            stages = " ".join(
+                f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in result["stages"].items()
+            )
+            memory = (
+                f" peak={result['peak_memory_bytes'] / 2**20:.1f}MiB"
+                if "peak_memory_bytes" in result
+                else ""
+            )
+            print(
+                f"players={players} trace_depth={trace_depth} generations={generations}: "
+                f"{result['decisions']} decisions, {result['decisions_per_second'] or 0:.0f} decisions/s{memory}\n\t{stages}"
+            )
+    finally:
+        os.chdir(cwd)
+        workdir.cleanup()
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        failures += regressions
+    if failures:
+        sys.exit(1)
@@ -0,0 +1,30 @@
+import argparse
+import multiprocessing
+from game.distributed import BrokerManager, broker_authkey, parse_address, serve_worker
+
+if __name__ == "__main__":
+    # DONORS_GAME_BROKER_AUTHKEY=... python cluster.py broker 0.0.0.0:50000
+    # DONORS_GAME_BROKER_AUTHKEY=... python cluster.py worker broker-host:50000 --processes 4 --threads 16
+    # then run games with engine="distributed", broker_address="broker-host:50000"
+    parser = argparse.ArgumentParser(description="Broker and workers for the distributed engine")
+    parser.add_argument("role", choices=["broker", "worker"])
+    parser.add_argument("address", help="host:port the broker listens on or workers connect to")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes on this host")
+    parser.add_argument("--threads", type=int, default=16, help="concurrent LLM calls per worker process")
+    args = parser.parse_args()
+
+    address = parse_address(args.address)
+    authkey = broker_authkey()
+    if args.role == "broker":
+        print(f"Broker listening on {args.address}")
+        BrokerManager(address=address, authkey=authkey).get_server().serve_forever()
+    else:
+        context = multiprocessing.get_context("spawn")
+        workers = [
+            context.Process(target=serve_worker, args=(address, authkey, args.threads))
+            for _ in range(args.processes)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,344 @@
+import multiprocessing
+import os
+import queue
+import secrets
+import socket
+import threading
+import time
+import uuid
+from multiprocessing.managers import BaseManager
+from typing import Dict, List, Optional, Tuple
+from models.config import GameState, Decision
+from game.player import Player
+from utils.api import configure_cache, configure_client, configure_parsing
+from utils.metrics import call_metrics, capture_calls
+
+# seconds a blocking call on the board waits before its caller checks back
+POLL_TIMEOUT = 1.0
+# seconds without a heartbeat after which a worker counts as lost and its tasks are requeued
+WORKER_TIMEOUT = 10 * POLL_TIMEOUT
+
+
+class WorkBoard:
+    """
+    Lives in the broker process. Orchestrators publish donation tasks that any
+    worker may take, and each orchestrator collects its results from its own
+    reply queue, so several runs can share one broker and pool of workers.
+    Taken tasks stay assigned to their worker until it replies, so the tasks
+    of a worker that stops sending heartbeats can be handed to another.
+    """
+
+    def __init__(self):
+        self.tasks: queue.Queue = queue.Queue()
+        self.replies: Dict[str, queue.Queue] = {}
+        # worker -> (reply_to, task id) -> task, and when each worker was last heard from
+        self.assigned: Dict[str, Dict[tuple, dict]] = {}
+        self.seen: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def reply_queue(self, reply_to: str) -> queue.Queue:
+        with self.lock:
+            return self.replies.setdefault(reply_to, queue.Queue())
+
+    def publish(self, tasks: List[dict]):
+        for task in tasks:
+            self.tasks.put(task)
+
+    def heartbeat(self, worker: str):
+        with self.lock:
+            self.seen[worker] = time.monotonic()
+
+    def take(self, worker: str, timeout: float = POLL_TIMEOUT) -> Optional[dict]:
+        try:
+            task = self.tasks.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self.lock:
+            self.seen[worker] = time.monotonic()
+            self.assigned.setdefault(worker, {})[(task["reply_to"], task["id"])] = task
+        return task
+
+    def reply(self, worker: str, reply_to: str, result: dict):
+        with self.lock:
+            self.assigned.get(worker, {}).pop((reply_to, result["id"]), None)
+        self.reply_queue(reply_to).put(result)
+
+    def requeue_lost(self, timeout: float = WORKER_TIMEOUT) -> int:
+        """Publishes again the tasks of workers not heard from for `timeout` seconds, returning how many."""
+        now = time.monotonic()
+        with self.lock:
+            lost = [worker for worker, seen in self.seen.items() if now - seen > timeout]
+            tasks = []
+            for worker in lost:
+                del self.seen[worker]
+                tasks += self.assigned.pop(worker, {}).values()
+        self.publish(tasks)
+        return len(tasks)
+
+    def collect(self, reply_to: str, timeout: float = POLL_TIMEOUT) -> List[dict]:
+        """Waits up to `timeout` for a result, then returns it with every other result already in."""
+        replies = self.reply_queue(reply_to)
+        try:
+            results = [replies.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                results.append(replies.get_nowait())
+            except queue.Empty:
+                return results
+
+    def close(self, reply_to: str):
+        with self.lock:
+            self.replies.pop(reply_to, None)
+
+
+board = WorkBoard()
+
+
+def get_board() -> WorkBoard:
+    return board
+
+
+class BrokerManager(BaseManager):
+    pass
+
+
+BrokerManager.register("get_board", callable=get_board)
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+def broker_authkey() -> bytes:
+    # the broker exchanges pickles, so only processes holding the key may connect
+    authkey = os.getenv("DONORS_GAME_BROKER_AUTHKEY")
+    if not authkey:
+        raise ValueError("Missing DONORS_GAME_BROKER_AUTHKEY")
+    return authkey.encode()
+
+
+def connect_board(address: Tuple[str, int], authkey: bytes):
+    manager = BrokerManager(address=address, authkey=authkey)
+    manager.connect()
+    return manager.get_board()
+
+
+def check_distributed(game_state: GameState):
+    """Rejects settings the distributed engine doesn't support, rather than ignoring them."""
+    if game_state.donation_mode != "individual":
+        raise ValueError(
+            f"The distributed engine asks for each donation separately, "
+            f"donation_mode {game_state.donation_mode} isn't supported"
+        )
+    if game_state.hedge_percentile is not None:
+        raise ValueError("The distributed engine doesn't hedge, unset hedge_percentile")
+
+
+def donation_task(
+    donor: Player, recipient: Player, game_state: GameState, reply_to: str, index: int
+) -> dict:
+    """
+    Everything a worker needs to decide one donation without the rest of the
+    population: both players' public state, the recipient's trace and their
+    last decision (for tit_for_tat), and the game state of the round.
+    """
+    previous_round = recipient.decisions_by_round.get(game_state.round - 1)
+    return {
+        "reply_to": reply_to,
+        "id": (game_state.generation, game_state.round, index),
+        "game_state": game_state,
+        "donor": {"name": donor.name, "strategy": donor.strategy, "wallet": donor.wallet},
+        "recipient": {
+            "name": recipient.name,
+            "strategy": recipient.strategy,
+            "wallet": recipient.wallet,
+            "trace_lines": recipient.trace_lines,
+            "last_decision": recipient.decision_table.decision(previous_round).model_dump()
+            if previous_round is not None
+            else None,
+        },
+    }
+
+
+class WorkQueue:
+    """The orchestrator's side of a broker: publishes a round's donation tasks and gathers the percentages."""
+
+    def __init__(self, address: Tuple[str, int], authkey: bytes):
+        self.board = connect_board(address, authkey)
+        self.reply_to = uuid.uuid4().hex
+
+    def map(
+        self,
+        pairs: List[Tuple[Player, Player]],
+        game_state: GameState,
+        deadline: Optional[float] = None,
+    ) -> List[dict]:
+        """
+        Results of every pair in order, each {"donation_percent": ...} or
+        {"error": ...}. Pairs still undecided after `deadline` seconds get a
+        timeout error, and their late results are dropped next round. Tasks
+        of a worker that died are requeued, so without a deadline every pair
+        is still decided as long as some worker is alive.
+        """
+        # sent as the model itself, as revalidating a dump would turn e.g. a default
+        # donation_multiplier of 2 into 2.0 and change the prompts
+        state = game_state.model_copy()
+        tasks = [
+            donation_task(donor, recipient, state, self.reply_to, i)
+            for i, (donor, recipient) in enumerate(pairs)
+        ]
+        self.board.publish(tasks)
+        started = time.perf_counter()
+        results: Dict[int, dict] = {}
+        current = (game_state.generation, game_state.round)
+        while len(results) < len(tasks):
+            if self.board.requeue_lost():
+                print("Requeued the donations of a lost worker")
+            timeout = POLL_TIMEOUT
+            if deadline is not None:
+                timeout = min(timeout, deadline - (time.perf_counter() - started))
+                if timeout <= 0:
+                    break
+            for result in self.board.collect(self.reply_to, timeout):
+                generation, round_number, index = result["id"]
+                # a requeued task may be answered twice, the first answer counts
+                if (generation, round_number) == current:
+                    results.setdefault(index, result)
+                if result["call_records"]:
+                    call_metrics.extend(result["call_records"])
+        return [
+            results.get(i, {"error": f"No donation after {deadline}s"})
+            for i in range(len(tasks))
+        ]
+
+    def close(self):
+        self.board.close(self.reply_to)
+
+
+def task_player(game_state: GameState, state: dict) -> Player:
+    player = Player(
+        game_state=game_state,
+        i=int(state["name"].split("_")[-1]),
+        strategy=state["strategy"],
+    )
+    player.wallet = state["wallet"]
+    return player
+
+
+class DonationWorker:
+    """
+    Decides donation tasks with `threads` concurrent LLM calls. It keeps no
+    game state between tasks: both players are rebuilt from each task.
+    """
+
+    def __init__(self, board, threads: int):
+        self.board = board
+        self.threads = threads
+        self.name = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.cache_config: Optional[tuple] = None
+        self.parsing_config: Optional[tuple] = None
+        self.lock = threading.Lock()
+
+    def configure(self, game_state: GameState):
+        cache_config = (game_state.cache_mode, game_state.cache_dir, game_state.cache_max_bytes)
+        parsing_config = (game_state.output_mode, game_state.parse_retries, game_state.repair_outputs)
+        with self.lock:
+            if cache_config != self.cache_config:
+                configure_cache(*cache_config)
+                self.cache_config = cache_config
+            if parsing_config != self.parsing_config:
+                configure_parsing(*parsing_config)
+                self.parsing_config = parsing_config
+            configure_client(
+                timeout=game_state.request_timeout, max_retries=game_state.max_retries
+            )
+
+    def decide(self, task: dict) -> dict:
+        game_state = task["game_state"]
+        self.configure(game_state)
+        donor = task_player(game_state, task["donor"])
+        recipient = task_player(game_state, task["recipient"])
+        recipient.trace_lines = task["recipient"]["trace_lines"]
+        if task["recipient"]["last_decision"] is not None:
+            recipient.record_decision(Decision(**task["recipient"]["last_decision"]))
+        result = {"id": task["id"]}
+        # sent back so the orchestrator's metrics cover every call
+        with capture_calls() as call_records:
+            try:
+                result["donation_percent"] = donor.generate_donation(
+                    game_state, recipient
+                )
+            except Exception as e:
+                result["error"] = repr(e)
+        result["call_records"] = call_records
+        return result
+
+    def work(self, stop: threading.Event):
+        try:
+            while not stop.is_set():
+                task = self.board.take(self.name)
+                if task is not None:
+                    self.board.reply(self.name, task["reply_to"], self.decide(task))
+        except (EOFError, ConnectionError):
+            print(f"Worker {os.getpid()} lost the broker")
+            stop.set()
+
+    def beat(self, stop: threading.Event):
+        # from its own thread, so long LLM calls don't make the worker look lost
+        try:
+            while not stop.is_set():
+                self.board.heartbeat(self.name)
+                stop.wait(POLL_TIMEOUT)
+        except (EOFError, ConnectionError):
+            stop.set()
+
+    def serve(self, stop: Optional[threading.Event] = None):
+        stop = stop or threading.Event()
+        threads = [
+            threading.Thread(target=self.work, args=(stop,), daemon=True)
+            for _ in range(self.threads)
+        ]
+        threads.append(threading.Thread(target=self.beat, args=(stop,), daemon=True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+
+def serve_worker(address: Tuple[str, int], authkey: bytes, threads: int):
+    print(f"Worker {os.getpid()} taking donations from {address[0]}:{address[1]}")
+    DonationWorker(connect_board(address, authkey), threads).serve()
+
+
+class LocalCluster:
+    """
+    A broker and worker processes on this machine, standing in for a
+    multi-host deployment when `broker_address` is not set.
+    """
+
+    def __init__(self, workers: int, threads: int):
+        context = multiprocessing.get_context("spawn")
+        self.authkey = secrets.token_bytes(16)
+        self.manager = BrokerManager(address=("127.0.0.1", 0), authkey=self.authkey, ctx=context)
+        self.manager.start()
+        self.address = self.manager.address
+        self.workers = [
+            context.Process(
+                target=serve_worker,
+                args=(self.address, self.authkey, threads),
+                daemon=True,
+            )
+            for _ in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.terminate()
+        for worker in self.workers:
+            worker.join()
+        self.manager.shutdown()
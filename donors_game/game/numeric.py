@@ -0,0 +1,148 @@
+import itertools
+from typing import Dict, List, Optional
+import numpy as np
+from models.config import NumericGameConfig
+
+# parameters that can differ between replicas of one batched run
+SWEEPABLE = (
+    "bad_reputation_thresh",
+    "good_reputation_thresh",
+    "donate_thresh",
+    "prob_pos_sum",
+    "pos_sum_mult",
+    "reputation_update",
+    "cost",
+)
+
+
+def softmax(x: np.ndarray) -> np.ndarray:
+    return x / np.sqrt(1 + x**2)
+
+
+def sample_derangements(rng: np.random.Generator, replicas: int, n: int) -> np.ndarray:
+    """
+    One uniformly random derangement of range(n) per row. Rows with a fixed
+    point are redrawn, which accepts ~1/e of the draws, so the expected cost
+    stays linear in n.
+    """
+    if n < 2:
+        raise ValueError("A derangement needs at least 2 agents")
+    identity = np.arange(n)
+    perms = rng.permuted(np.tile(identity, (replicas, 1)), axis=1)
+    rejected = (perms == identity).any(axis=1)
+    while rejected.any():
+        rows = np.flatnonzero(rejected)
+        perms[rows] = rng.permuted(np.tile(identity, (len(rows), 1)), axis=1)
+        rejected[rows] = (perms[rows] == identity).any(axis=1)
+    return perms
+
+
+class NumericDonorGame:
+    """
+    Array version of the numeric Donor Game from donors_game-numeric.ipynb.
+    Wallets, reputations and information probabilities are (replicas, agents)
+    arrays and a whole round is a handful of batched operations. Every agent
+    donates once per round to its partner in a random derangement, and all
+    decisions in a round see the reputations from the start of that round.
+
+    Any name in SWEEPABLE can be overridden with one value per replica to
+    run a parameter sweep as a single batch.
+    """
+
+    def __init__(self, config: NumericGameConfig, **per_replica: np.ndarray):
+        self.config = config
+        self.rng = np.random.default_rng(config.seed)
+        shape = (config.replicas, config.agents)
+        self.wallets = np.full(shape, float(config.base_wallet))
+        self.reputations = np.zeros(shape)
+        self.q = self.rng.normal(config.q, config.q_std, shape)
+        self.params: Dict[str, np.ndarray] = {}
+        for name in SWEEPABLE:
+            values = per_replica.get(name, getattr(config, name))
+            # (replicas, 1) so parameters broadcast across each replica's agents
+            self.params[name] = np.broadcast_to(
+                np.asarray(values, dtype=float).reshape(-1, 1), (config.replicas, 1)
+            )
+        unknown = set(per_replica) - set(SWEEPABLE)
+        if unknown:
+            raise ValueError(f"Parameters {sorted(unknown)} can't vary per replica")
+
+    def play_round(self):
+        config, params = self.config, self.params
+        shape = (config.replicas, config.agents)
+        rows = np.arange(config.replicas)[:, None]
+        recipients = sample_derangements(self.rng, config.replicas, config.agents)
+
+        donor_reputation = softmax(self.reputations)
+        recipient_reputation = donor_reputation[rows, recipients]
+
+        perfect_information = self.rng.random(shape) < self.q
+        donate = perfect_information & (recipient_reputation >= params["donate_thresh"])
+        positive_sum = self.rng.random(shape) < params["prob_pos_sum"]
+        cost = np.broadcast_to(params["cost"], shape)
+        received = np.where(positive_sum, cost * params["pos_sum_mult"], cost)
+
+        self.wallets -= np.where(donate, cost, 0.0)
+        # recipients is a permutation per row, so no index repeats within a row
+        self.wallets[rows, recipients] += np.where(donate, received, 0.0)
+
+        # refusing a bad-reputation recipient keeps a good reputation intact
+        justified = (donor_reputation >= params["good_reputation_thresh"]) & (
+            recipient_reputation <= params["bad_reputation_thresh"]
+        )
+        update = np.broadcast_to(params["reputation_update"], shape)
+        self.reputations += np.where(donate, update, np.where(justified, 0.0, -update))
+
+    def totals(self) -> Dict[str, np.ndarray]:
+        return {
+            "total_reputation": softmax(self.reputations).sum(axis=1),
+            "total_wallet": self.wallets.sum(axis=1),
+        }
+
+    def run(self) -> Dict[str, np.ndarray]:
+        """Plays every round and returns each total as a (rounds, replicas) array."""
+        totals: Dict[str, List[np.ndarray]] = {"total_reputation": [], "total_wallet": []}
+        for _ in range(self.config.rounds):
+            self.play_round()
+            for name, value in self.totals().items():
+                totals[name].append(value)
+        return {name: np.stack(values) for name, values in totals.items()}
+
+
+def sweep(
+    config: NumericGameConfig,
+    grid: Dict[str, List[float]],
+    replicas_per_point: int = 1,
+    seed: Optional[int] = None,
+) -> List[dict]:
+    """
+    Runs every combination of `grid` values with `replicas_per_point` replicas
+    each, all in one batched game. Returns one entry per grid point with its
+    parameters and final totals averaged over its replicas.
+    """
+    names = list(grid)
+    points = list(itertools.product(*(grid[name] for name in names)))
+    per_replica = {
+        name: np.repeat([point[i] for point in points], replicas_per_point)
+        for i, name in enumerate(names)
+    }
+    batch_config = config.model_copy(
+        update={
+            "replicas": len(points) * replicas_per_point,
+            "seed": seed if seed is not None else config.seed,
+        }
+    )
+    totals = NumericDonorGame(batch_config, **per_replica).run()
+    results = []
+    for i, point in enumerate(points):
+        replicas = slice(i * replicas_per_point, (i + 1) * replicas_per_point)
+        results.append(
+            {
+                **dict(zip(names, point)),
+                **{
+                    name: float(values[-1, replicas].mean())
+                    for name, values in totals.items()
+                },
+            }
+        )
+    return results
@@ -1,190 +1,963 @@
-from typing import List, Tuple, Optional
-from models.config import GameState
+from typing import Dict, List, Tuple, Optional
+from models.config import GameState, Decision
+from models.decision_table import DecisionTable
 from game.player import Player
+from game.policies import Policy, get_policy
+from game.pairing import get_pairing
+from game.selection import get_selection, parents_for_children
+from game.distributed import (
+    LocalCluster,
+    WorkQueue,
+    broker_authkey,
+    check_distributed,
+    parse_address,
+)
 from utils.misc import sanitize_filename
-from utils.telemetry import tracer
+from utils.run_log import RunLog, expand_decisions
+from utils.telemetry import tracer, set_lazy_attribute
+from utils.api import (
+    configure_async_client,
+    configure_cache,
+    configure_client,
+    configure_parsing,
+)
+from utils.metrics import (
+    call_metrics,
+    call_cost,
+    summarize_calls,
+    aggregate_calls,
+    tag_calls,
+    queued_since,
+    percentile,
+)
 from openinference.semconv.trace import SpanAttributes, OpenInferenceSpanKindValues
 from opentelemetry import context as context_api
+import asyncio
 import json
 import os
-from concurrent.futures import ThreadPoolExecutor
+import pickle
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import random
+import time
+
+
+# earlier donation calls needed before hedging, so the percentile means something
+HEDGE_MIN_CALLS = 20
+# seconds between checks on calls still queued for a worker
+STRAGGLER_POLL_INTERVAL = 0.05
+
+
+def save_path_for(game_state: GameState) -> str:
+    dir_path = f"g{game_state.generations}_r{game_state.rounds}_p{game_state.players}"
+    if game_state.run_tag:
+        dir_path += f"_{game_state.run_tag}"
+    dir_path += "/"
+    save_path = (
+        game_state.save_path
+        or f"g{game_state.generations}_r{game_state.rounds}_p{game_state.players}.json"
+    )
+    return f"../data/{sanitize_filename(game_state.model_name)}/" + dir_path + save_path
+
+
+def checkpoint_path_for(game_state: GameState) -> str:
+    return os.path.splitext(save_path_for(game_state))[0] + ".ckpt"
 
 
 class Orchestrator:
-    def __init__(self, game_state: GameState):
+    def __init__(
+        self,
+        game_state: GameState,
+        players: Optional[List[Player]] = None,
+        decision_table: Optional[DecisionTable] = None,
+    ):
         with tracer.start_as_current_span("init_orchestrator") as span:
             span.set_attribute(
                 SpanAttributes.OPENINFERENCE_SPAN_KIND,
                 OpenInferenceSpanKindValues.CHAIN.value,
             )
-            span.set_attribute(
-                SpanAttributes.INPUT_VALUE, game_state.model_json_schema()
+            set_lazy_attribute(
+                span,
+                SpanAttributes.INPUT_VALUE,
+                lambda: json.dumps(game_state.model_json_schema()),
             )
             self.game_state = game_state
-            self.players = [
-                Player(game_state=game_state, i=i) for i in range(game_state.players)
-            ]
-
-            dir_path = (
-                f"g{game_state.generations}_r{game_state.rounds}_p{game_state.players}/"
+            self._executor: Optional[ThreadPoolExecutor] = None
+            self._work_queue: Optional[WorkQueue] = None
+            self._cluster: Optional[LocalCluster] = None
+            # draw a seed when none is given, so every saved run records the one it used
+            if game_state.seed is None:
+                game_state.seed = random.SystemRandom().randrange(2**32)
+            # the run's own RNG stream, pickled with checkpoints
+            self.rng = random.Random(game_state.seed)
+            self.pairing = get_pairing(game_state)
+            self.selection = get_selection(game_state)
+            if game_state.engine == "distributed":
+                check_distributed(game_state)
+            configure_cache(
+                mode=game_state.cache_mode,
+                path=game_state.cache_dir,
+                max_bytes=game_state.cache_max_bytes,
             )
+            configure_parsing(
+                mode=game_state.output_mode,
+                retries=game_state.parse_retries,
+                repair=game_state.repair_outputs,
+            )
+            configure_client(
+                timeout=game_state.request_timeout, max_retries=game_state.max_retries
+            )
+            # decides batched donations, players keep their own policy for everything else
+            self.policy: Policy = get_policy(game_state)
+            # every player's history is a view over this table
+            self.decision_table = (
+                decision_table if decision_table is not None else DecisionTable()
+            )
+            # per-call metrics of this run's LLM calls, see `metrics`
+            self.call_records: List[dict] = []
+            call_metrics.drain()
+            # the async engine spawns its players inside the event loop in `arun`
+            self.players = players or []
+            if not self.players and game_state.engine != "async":
+                self.players = Player.spawn(
+                    game_state=game_state,
+                    count=game_state.players,
+                    decision_table=self.decision_table,
+                )
+                self.collect_call_metrics()
+
             if not game_state.save_path:
                 game_state.save_path = f"g{game_state.generations}_r{game_state.rounds}_p{game_state.players}.json"
-            self.save_path = f"../data/{sanitize_filename(game_state.model_name)}/" + dir_path + game_state.save_path
+            self.save_path = save_path_for(game_state)
+            self.checkpoint_path = checkpoint_path_for(game_state)
 
+            # rosters without decisions, which only live in the decision table
             self.history = {}
+            # rounds of the current generation already played, so `run` can pick up from a checkpoint
+            self.rounds_played = 0
+            self.last_round_decisions: List[Decision] = []
+            self.rounds_since_snapshot = 0
+            self.run_log: Optional[RunLog] = None
+            if game_state.persistence == "stream":
+                self.run_log = RunLog(os.path.splitext(self.save_path)[0] + ".jsonl")
+                self.run_log.start(game_state.model_dump())
+
+    @property
+    def players(self) -> List[Player]:
+        return self._players
+
+    @players.setter
+    def players(self, players: List[Player]):
+        # keep the name index in sync whenever a generation is (re)assigned
+        self._players = players
+        self.players_by_name: Dict[str, Player] = {
+            player.name: player for player in players
+        }
 
     def find_player(self, name: str) -> Player:
-        for player in self.players:
-            if player.name == name:
-                return player
-        raise ValueError(f"Player {name} not found")
+        if name not in self.players_by_name:
+            raise ValueError(f"Player {name} not found")
+        return self.players_by_name[name]
 
     def create_donor_recipient_pairs(self) -> List[Tuple[Player, Player]]:
+        """Pairs every player as a donor with a recipient using the configured pairing scheme."""
+        recipients = self.pairing(self.rng, len(self.players), self.game_state)
+        return [
+            (self.players[donor], self.players[recipient])
+            for donor, recipient in enumerate(recipients)
+        ]
+
+    def setup_round(self, span) -> List[Tuple[Player, Player]]:
+        set_lazy_attribute(
+            span,
+            SpanAttributes.INPUT_VALUE,
+            lambda: self.game_state.model_dump_json(),
+        )
+        span.set_attribute(
+            SpanAttributes.OPENINFERENCE_SPAN_KIND,
+            OpenInferenceSpanKindValues.CHAIN.value,
+        )
+        pairs = self.create_donor_recipient_pairs()
+        set_lazy_attribute(
+            span,
+            SpanAttributes.OUTPUT_VALUE,
+            lambda: json.dumps(
+                [f"{donor.name} -> {recipient.name}" for donor, recipient in pairs]
+            ),
+        )
+        return pairs
+
+    def finish_round(self, results: List[Decision]):
+        # wallets stay static while decisions are made and are only updated here
+        self.last_round_decisions = results
+        for result in results:
+            donor = self.find_player(result.donor_name)
+            recipient = self.find_player(result.recipient_name)
+            donor.execute_donation(recipient, self.game_state, result)
+
+        self.update_traces(results)
+        self.game_state.round += 1
+        self.collect_call_metrics()
+
+    def update_traces(self, results: List[Decision]):
         """
-        Builds a random pairing so that no player is matched with themselves.
-        Not strictly uniform over all derangements, but typically good enough.
+        Extends the trace table by the round just played. A donor's new entry
+        is their donation followed by their recipient's entry from before the
+        round, cut to `trace_depth` lines. That is one short tuple per player
+        per round however deep traces go, and donors read their recipient's
+        entry instead of rebuilding the chain.
         """
-        n = len(self.players)
-        available = list(range(n))
-        result = [None] * n
-
-        for i in range(n):
-            # Exclude i from the candidates
-            candidates = [x for x in available if x != i]
-
-            # If there is no candidate (happens if i is the only one left in available),
-            # we need to 'repair' by swapping with a previously assigned position.
-            if not candidates:
-                # Swap with any earlier position that isn't i
-                # Because it implies we must have assigned some position j = i earlier
-                # and it's causing a corner case now.
-                for j in range(i):
-                    if result[j] != j:
-                        old_assignee = result[j]
-                        result[j] = i
-                        result[i] = old_assignee
-                        break
+        depth = self.game_state.trace_depth
+        played = self.game_state.round
+        traces = {player.name: () for player in self.players}
+        # round 0 never shows up in traces
+        if depth > 0 and played >= 1:
+            for result in results:
+                recipient = self.find_player(result.recipient_name)
+                traces[result.donor_name] = (
+                    f"In round {played}, {result.donor_name} donated {result.donation_percent}% of their resources to {result.recipient_name}.\n",
+                ) + recipient.trace_lines[: depth - 1]
+        for player in self.players:
+            player.trace_lines = traces[player.name]
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # kept for the whole run, so abandoned straggler calls never hold up a round
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.game_state.max_concurrency
+            )
+        return self._executor
 
+    @property
+    def work_queue(self) -> WorkQueue:
+        # connected on the first distributed round, to a local stand-in cluster without `broker_address`
+        if self._work_queue is None:
+            if self.game_state.broker_address is None:
+                self._cluster = LocalCluster(
+                    workers=self.game_state.local_workers,
+                    threads=self.game_state.max_concurrency,
+                )
+                self._work_queue = WorkQueue(self._cluster.address, self._cluster.authkey)
             else:
-                choice = random.choice(candidates)
-                result[i] = choice
-                available.remove(choice)
+                self._work_queue = WorkQueue(
+                    parse_address(self.game_state.broker_address), broker_authkey()
+                )
+        return self._work_queue
+
+    def shutdown_workers(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._work_queue is not None:
+            self._work_queue.close()
+            self._work_queue = None
+        if self._cluster is not None:
+            self._cluster.shutdown()
+            self._cluster = None
 
-        # Now result[i] = index of the player who receives from i.
-        # Convert that into (donor, recipient) pairs:
-        return [(self.players[i], self.players[result[i]]) for i in range(n)]
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # threads and connections can't be pickled, a resumed run starts its own
+        state["_executor"] = None
+        state["_work_queue"] = None
+        state["_cluster"] = None
+        return state
 
     def play_round(self):
+        if self.game_state.engine == "distributed":
+            return self.play_distributed_round()
         with tracer.start_as_current_span("play_round") as span:
-            span.set_attribute(
-                SpanAttributes.INPUT_VALUE, self.game_state.model_dump_json()
-            )
-            span.set_attribute(
-                SpanAttributes.OPENINFERENCE_SPAN_KIND,
-                OpenInferenceSpanKindValues.CHAIN.value,
-            )
-            pairs = self.create_donor_recipient_pairs()
-            span.set_attribute(
-                SpanAttributes.OUTPUT_VALUE,
-                json.dumps(
-                    [f"{donor.name} -> {recipient.name}" for donor, recipient in pairs]
-                ),
-            )
-            # TODO: can be parallelized but need to keep wallets static untill the end
+            pairs = self.setup_round(span)
 
             current_context = context_api.get_current()
+            executor = self.executor
 
-            with ThreadPoolExecutor() as executor:
+            if self.game_state.donation_mode == "batched":
+                batches = self.donation_batches(pairs)
+                submitted_at = time.perf_counter()
                 futures = [
-                    executor.submit(
-                        donor.setup_donation,
-                        recipient,
-                        self.game_state,
-                        self.players,
-                        current_context,
-                    )
-                    for donor, recipient in pairs
+                    executor.submit(self.decide_batch, batch, current_context, submitted_at)
+                    for batch in batches
                 ]
-                # Wait for all donations to complete
-                results = [future.result() for future in futures]
+                wait(futures, timeout=self.batch_timeout(submitted_at))
+                results = self.batch_results(batches, futures, submitted_at)
+            else:
+                results = [None] * len(pairs)
 
-            for result in results:
-                donor = self.find_player(result.donor_name)
-                recipient = self.find_player(result.recipient_name)
-                donor.execute_donation(recipient, self.game_state, result)
+            # deadlines run from submission, hedges from when a call actually
+            # started, as calls may queue for a worker
+            submitted: Dict[int, float] = {}
+            starts: Dict[int, float] = {}
 
-            self.game_state.round += 1
+            def setup_donation(i: int, submitted_at: float) -> Decision:
+                starts.setdefault(i, time.perf_counter())
+                donor, recipient = pairs[i]
+                with queued_since(submitted_at):
+                    return donor.setup_donation(
+                        recipient, self.game_state, current_context
+                    )
 
-    def evolve(self):
-        with tracer.start_as_current_span("evolve") as span:
+            def submit(i: int):
+                submitted_at = time.perf_counter()
+                submitted.setdefault(i, submitted_at)
+                return executor.submit(setup_donation, i, submitted_at)
+
+            # donors without a batched decision are asked individually
+            missing = [i for i, result in enumerate(results) if result is None]
+            attempts = {i: [submit(i)] for i in missing}
+            decided: Dict[int, Decision] = {}
+            hedge_delay = self.hedge_delay()
+            # Wait for all donations to complete, or fall back
+            while len(decided) < len(attempts):
+                wait(
+                    self.pending_attempts(attempts, decided),
+                    timeout=self.next_wakeup(
+                        attempts, submitted, starts, decided, hedge_delay
+                    ),
+                    return_when=FIRST_COMPLETED,
+                )
+                self.check_attempts(
+                    pairs, attempts, submitted, starts, decided, submit, hedge_delay
+                )
+            for i, decision in decided.items():
+                results[i] = decision
+
+            self.finish_round(results)
+
+    async def aplay_round(self):
+        with tracer.start_as_current_span("play_round") as span:
+            pairs = self.setup_round(span)
+            if self.game_state.donation_mode == "batched":
+                batches = self.donation_batches(pairs)
+                submitted_at = time.perf_counter()
+                tasks = [asyncio.ensure_future(self.adecide_batch(batch)) for batch in batches]
+                if tasks:
+                    await asyncio.wait(tasks, timeout=self.batch_timeout(submitted_at))
+                results = self.batch_results(batches, tasks, submitted_at)
+            else:
+                results = [None] * len(pairs)
+
+            starts: Dict[int, float] = {}
+
+            def setup_donation(i: int) -> asyncio.Task:
+                starts.setdefault(i, time.perf_counter())
+                donor, recipient = pairs[i]
+                return asyncio.ensure_future(
+                    donor.asetup_donation(recipient, self.game_state)
+                )
+
+            # donors without a batched decision are asked individually
+            missing = [i for i, result in enumerate(results) if result is None]
+            attempts = {i: [setup_donation(i)] for i in missing}
+            decided: Dict[int, Decision] = {}
+            hedge_delay = self.hedge_delay()
+            try:
+                while len(decided) < len(attempts):
+                    # tasks start as soon as they are created, so they were submitted then too
+                    await asyncio.wait(
+                        self.pending_attempts(attempts, decided),
+                        timeout=self.next_wakeup(
+                            attempts, starts, starts, decided, hedge_delay
+                        ),
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                    self.check_attempts(
+                        pairs, attempts, starts, starts, decided, setup_donation, hedge_delay
+                    )
+            finally:
+                # losing hedges and calls past their deadline
+                for tasks in attempts.values():
+                    for task in tasks:
+                        task.cancel()
+            for i, decision in decided.items():
+                results[i] = decision
+            self.finish_round(results)
+
+    def play_distributed_round(self):
+        """
+        Publishes the round's donations to the broker and waits for the
+        workers' percentages. Decisions are still built and applied here, in
+        pair order, so wallets update exactly as with the other engines.
+        """
+        with tracer.start_as_current_span("play_round") as span:
+            pairs = self.setup_round(span)
+            outcomes = self.work_queue.map(
+                pairs, self.game_state, self.game_state.donation_deadline
+            )
+            results = self.batch_decisions(
+                pairs, [outcome.get("donation_percent") for outcome in outcomes]
+            )
+            for i, outcome in enumerate(outcomes):
+                if "error" in outcome:
+                    results[i] = self.fallback_decision(
+                        *pairs[i], RuntimeError(outcome["error"])
+                    )
+            self.finish_round(results)
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds after which a donation call gets a duplicate request: the `hedge_percentile` of this run's donation latencies."""
+        if self.game_state.hedge_percentile is None:
+            return None
+        latencies = sorted(
+            record["latency"]
+            for record in self.call_records
+            if record["kind"] == "donation"
+            and not record["cache_hits"]
+            and not record["errors"]
+        )
+        if len(latencies) < HEDGE_MIN_CALLS:
+            return None
+        return percentile(latencies, self.game_state.hedge_percentile)
+
+    def pending_attempts(self, attempts: Dict[int, list], decided: Dict[int, Decision]) -> list:
+        return [
+            future
+            for i, futures in attempts.items()
+            if i not in decided
+            for future in futures
+        ]
+
+    def next_wakeup(
+        self,
+        attempts: Dict[int, list],
+        submitted: Dict[int, float],
+        starts: Dict[int, float],
+        decided: Dict[int, Decision],
+        hedge_delay: Optional[float],
+    ) -> Optional[float]:
+        """How long to wait for answers before the next hedge or deadline is due, None for as long as it takes."""
+        deadline = self.game_state.donation_deadline
+        if deadline is None and hedge_delay is None:
+            return None
+        now = time.perf_counter()
+        wakeups = []
+        for i, futures in attempts.items():
+            if i in decided:
+                continue
+            if deadline is not None:
+                wakeups.append(deadline - (now - submitted[i]))
+            if hedge_delay is not None and len(futures) == 1:
+                if i in starts:
+                    wakeups.append(hedge_delay - (now - starts[i]))
+                else:
+                    # still queued, check back once it may have started
+                    wakeups.append(STRAGGLER_POLL_INTERVAL)
+        return max(0.0, min(wakeups)) if wakeups else None
+
+    def check_attempts(
+        self,
+        pairs: List[Tuple[Player, Player]],
+        attempts: Dict[int, list],
+        submitted: Dict[int, float],
+        starts: Dict[int, float],
+        decided: Dict[int, Decision],
+        submit,
+        hedge_delay: Optional[float],
+    ):
+        """
+        Settles every undecided donation it can: takes the first successful
+        attempt, falls back once all attempts failed or the deadline (counted
+        from submission, so queued calls time out too) passed, and sends a
+        duplicate request for calls running longer than `hedge_delay`.
+        Works on thread futures and asyncio tasks alike.
+        """
+        deadline = self.game_state.donation_deadline
+        now = time.perf_counter()
+        for i, futures in attempts.items():
+            if i in decided:
+                continue
+            finished = [future for future in futures if future.done()]
+            answered = [future for future in finished if future.exception() is None]
+            if answered:
+                decided[i] = answered[0].result()
+            elif len(finished) == len(futures):
+                decided[i] = self.fallback_decision(*pairs[i], finished[-1].exception())
+            elif deadline is not None and now - submitted[i] >= deadline:
+                # queued calls are dropped, running ones end with request_timeout
+                for future in futures:
+                    future.cancel()
+                decided[i] = self.fallback_decision(
+                    *pairs[i],
+                    TimeoutError(f"No donation after {now - submitted[i]:.1f}s"),
+                )
+            elif (
+                hedge_delay is not None
+                and len(futures) == 1
+                and i in starts
+                and now - starts[i] >= hedge_delay
+            ):
+                futures.append(submit(i))
+
+    def fallback_decision(
+        self, donor: Player, recipient: Player, error: BaseException
+    ) -> Decision:
+        """The configured `fallback` for a donation that failed or missed its deadline."""
+        fallback = self.game_state.fallback
+        if fallback == "raise":
+            raise error
+        if fallback == "zero":
+            donation_percent = 0.0
+        elif fallback == "repeat":
+            donation_percent = (
+                donor.history[-1].donation_percent if len(donor.history) else 0.0
+            )
+        else:
+            raise ValueError(
+                f"Unknown fallback {fallback}, expected 'raise', 'zero' or 'repeat'"
+            )
+        print(f"\n\n{donor.name} falls back to donating {donation_percent} after {error!r}")
+        with tracer.start_as_current_span(f"execute_donation-{donor.name}") as span:
             span.set_attribute(
                 SpanAttributes.OPENINFERENCE_SPAN_KIND,
                 OpenInferenceSpanKindValues.AGENT.value,
             )
-            span.set_attribute(
-                SpanAttributes.INPUT_VALUE, self.game_state.model_dump_json()
-            )
-            self.game_state.round = 1
-            self.game_state.generation += 1
-            print(f"\n\nEvolving to generation {self.game_state.generation}")
-            # sort players by wallet
-            self.players = sorted(self.players, key=lambda x: x.wallet, reverse=True)
-            # get top half
-            top_half = self.players[
-                : int(len(self.players) * self.game_state.cutoff_threshold)
+            span.record_exception(error)
+            return donor.build_decision(
+                span, recipient, self.game_state, donation_percent, fallback=True
+            )
+
+    def donation_batches(
+        self, pairs: List[Tuple[Player, Player]]
+    ) -> List[List[Tuple[Player, Player]]]:
+        size = self.game_state.donation_batch_size or len(pairs)
+        return [pairs[i : i + size] for i in range(0, len(pairs), size)]
+
+    def batch_decisions(
+        self, pairs: List[Tuple[Player, Player]], percents: List[Optional[float]]
+    ) -> List[Optional[Decision]]:
+        decisions = []
+        for (donor, recipient), percent in zip(pairs, percents):
+            if percent is None:
+                decisions.append(None)
+                continue
+            with tracer.start_as_current_span(f"execute_donation-{donor.name}") as span:
+                span.set_attribute(
+                    SpanAttributes.OPENINFERENCE_SPAN_KIND,
+                    OpenInferenceSpanKindValues.AGENT.value,
+                )
+                decisions.append(
+                    donor.answer_decision(span, recipient, self.game_state, percent)
+                )
+        return decisions
+
+    def tag_batch_calls(self):
+        return tag_calls(
+            kind="donation_batch",
+            generation=self.game_state.generation,
+            round=self.game_state.round,
+        )
+
+    def batch_timeout(self, submitted_at: float) -> Optional[float]:
+        deadline = self.game_state.donation_deadline
+        if deadline is None:
+            return None
+        return max(0.0, deadline - (time.perf_counter() - submitted_at))
+
+    def batch_results(
+        self,
+        batches: List[List[Tuple[Player, Player]]],
+        futures: list,
+        submitted_at: float,
+    ) -> List[Optional[Decision]]:
+        """
+        The decisions of every batch in pair order. Every donor of a batch
+        still running at the deadline falls back, as its call would hold up
+        the whole round. Works on thread futures and asyncio tasks alike.
+        """
+        results = []
+        for batch, future in zip(batches, futures):
+            if future.done():
+                results += future.result()
+                continue
+            # a queued batch is dropped, a running one ends with request_timeout
+            future.cancel()
+            error = TimeoutError(
+                f"No batched donation after {time.perf_counter() - submitted_at:.1f}s"
+            )
+            results += [
+                self.fallback_decision(donor, recipient, error) for donor, recipient in batch
             ]
-            # clone players
-            top_players_strings = "\n".join(
-                [
-                    f"player {player.name} with wallet {player.wallet} and strategy: {player.strategy}"
-                    for player in top_half
-                ]
+        return results
+
+    def decide_batch(
+        self,
+        pairs: List[Tuple[Player, Player]],
+        context: context_api.Context,
+        submitted_at: float,
+    ) -> List[Optional[Decision]]:
+        """Decides the donations of `pairs` in one call, None for donors the response left out."""
+        token = context_api.attach(context)
+        try:
+            with tracer.start_as_current_span(
+                "generate_donation_batch"
+            ) as span, self.tag_batch_calls(), queued_since(submitted_at):
+                span.set_attribute(
+                    SpanAttributes.OPENINFERENCE_SPAN_KIND,
+                    OpenInferenceSpanKindValues.LLM.value,
+                )
+                try:
+                    percents = self.policy.generate_donation_batch(
+                        self.game_state, pairs
+                    )
+                except Exception as e:
+                    percents = self.failed_batch(pairs, e)
+            return self.batch_decisions(pairs, percents)
+        finally:
+            context_api.detach(token)
+
+    async def adecide_batch(
+        self, pairs: List[Tuple[Player, Player]]
+    ) -> List[Optional[Decision]]:
+        with tracer.start_as_current_span(
+            "generate_donation_batch"
+        ) as span, self.tag_batch_calls():
+            span.set_attribute(
+                SpanAttributes.OPENINFERENCE_SPAN_KIND,
+                OpenInferenceSpanKindValues.LLM.value,
             )
-            print(f"\n\nTop half:\n{top_players_strings}")
-            self.players = [
-                Player(game_state=self.game_state, i=i, parents=top_half)
-                for i in range(self.game_state.players)
+            try:
+                percents = await self.policy.agenerate_donation_batch(
+                    self.game_state, pairs
+                )
+            except Exception as e:
+                percents = self.failed_batch(pairs, e)
+        return self.batch_decisions(pairs, percents)
+
+    def failed_batch(
+        self, pairs: List[Tuple[Player, Player]], error: Exception
+    ) -> List[Optional[float]]:
+        # with a fallback configured, the donors are asked individually instead
+        if self.game_state.fallback == "raise":
+            raise error
+        print(f"\n\nBatch of {len(pairs)} donations failed with {error!r}, asking individually")
+        return [None] * len(pairs)
+
+    def select_parents(self, span) -> List[Player]:
+        span.set_attribute(
+            SpanAttributes.OPENINFERENCE_SPAN_KIND,
+            OpenInferenceSpanKindValues.AGENT.value,
+        )
+        set_lazy_attribute(
+            span,
+            SpanAttributes.INPUT_VALUE,
+            lambda: self.game_state.model_dump_json(),
+        )
+        self.game_state.round = 1
+        self.game_state.generation += 1
+        print(f"\n\nEvolving to generation {self.game_state.generation}")
+        # e.g. the top half by wallet
+        top_half = self.selection(self.rng, self.players, self.game_state)
+        # clone players
+        top_players_strings = "\n".join(
+            [
+                f"player {player.name} with wallet {player.wallet} and strategy: {player.strategy}"
+                for player in top_half
             ]
+        )
+        print(f"\n\nTop half:\n{top_players_strings}")
+        return top_half
+
+    def evolve(self):
+        with tracer.start_as_current_span("evolve") as span:
+            top_half = self.select_parents(span)
+            self.players = Player.spawn(
+                game_state=self.game_state,
+                count=self.game_state.players,
+                decision_table=self.decision_table,
+                child_parents=parents_for_children(
+                    self.rng, top_half, self.game_state.players, self.game_state
+                ),
+            )
+            self.collect_call_metrics()
+
+    async def aevolve(self):
+        with tracer.start_as_current_span("evolve") as span:
+            top_half = self.select_parents(span)
+            self.players = await Player.aspawn(
+                game_state=self.game_state,
+                count=self.game_state.players,
+                decision_table=self.decision_table,
+                child_parents=parents_for_children(
+                    self.rng, top_half, self.game_state.players, self.game_state
+                ),
+            )
+            self.collect_call_metrics()
 
     def save_state(self):
+        if self.run_log:
+            self.log_round()
+            self.rounds_since_snapshot += 1
+            if self.rounds_since_snapshot < self.game_state.snapshot_every:
+                return
+        self.save_snapshot()
+
+    def log_round(self):
+        generation_key = f"g{self.game_state.generation}"
+        if generation_key not in self.history:
+            players = [player.model_dump(with_history=False) for player in self.players]
+            self.history[generation_key] = players
+            self.run_log.log_roster(self.game_state.generation, players)
+        self.run_log.log_round(
+            state={
+                "generation": self.game_state.generation,
+                "round": self.game_state.round,
+            },
+            decisions=[decision.model_dump() for decision in self.last_round_decisions],
+            wallets={player.name: player.wallet for player in self.players},
+        )
+
+    def save_snapshot(self):
+        self.rounds_since_snapshot = 0
         self.history[f"g{self.game_state.generation}"] = [
-            player.model_dump() for player in self.players
+            player.model_dump(with_history=False) for player in self.players
         ]
         os.makedirs(os.path.dirname(self.save_path), exist_ok=True)
         data = self.game_state.model_dump()
-        data["history"] = self.history
+        # copied, as the json format expands the rosters in place
+        data["history"] = dict(self.history)
+        # per-player histories are rebuilt from the columns by `load_game_state`
+        data["decisions"] = self.decision_table.model_dump()
+        if self.game_state.save_format == "json":
+            data = expand_decisions(data)
         with open(self.save_path, "w") as f:
             json.dump(data, f)
+        self.save_metrics()
 
     def run(self) -> List[Player]:
-        for generation_count in range(self.game_state.generations):
-            with tracer.start_as_current_span(f"generation_{generation_count}") as span:
-                span.set_attribute(
-                    SpanAttributes.INPUT_VALUE, self.game_state.model_dump_json()
-                )
-                span.set_attribute(
-                    SpanAttributes.OPENINFERENCE_SPAN_KIND,
-                    OpenInferenceSpanKindValues.CHAIN.value,
+        try:
+            for generation_count in range(
+                self.game_state.generation, self.game_state.generations
+            ):
+                with tracer.start_as_current_span(
+                    f"generation_{generation_count}"
+                ) as generation_span:
+                    self.start_generation(generation_span)
+                    for round_count in range(
+                        self.rounds_played, self.game_state.rounds
+                    ):
+                        with tracer.start_as_current_span(
+                            f"round_{round_count}"
+                        ) as span:
+                            self.start_round(span)
+                            self.play_round()
+                            self.save_state()
+                            self.rounds_played += 1
+                            if self.round_checkpoint_due():
+                                self.save_checkpoint()
+                    self.finish_generation(generation_span)
+                    if self.rounds_since_snapshot:
+                        self.save_snapshot()
+                    if self.game_state.generation < self.game_state.generations:
+                        self.evolve()
+                        self.rounds_played = 0
+                        self.save_checkpoint()
+        finally:
+            # a failed round would otherwise leave threads and cluster workers behind
+            self.shutdown_workers()
+
+        self.remove_checkpoint()
+        return self.players
+
+    async def arun(self) -> List[Player]:
+        """Runs the game on the async engine, with every LLM call on this event loop."""
+        # the other policies never call the model, so they run without openai or an API key
+        if self.game_state.policy == "llm":
+            configure_async_client(
+                max_concurrency=self.game_state.max_concurrency,
+                requests_per_minute=self.game_state.requests_per_minute,
+                tokens_per_minute=self.game_state.tokens_per_minute,
+                max_retries=self.game_state.max_retries,
+                timeout=self.game_state.request_timeout,
+            )
+        try:
+            if not self.players:
+                self.players = await Player.aspawn(
+                    game_state=self.game_state,
+                    count=self.game_state.players,
+                    decision_table=self.decision_table,
                 )
-                print(f"\n\nGeneration {self.game_state.generation}")
-                for round_count in range(self.game_state.rounds):
-                    with tracer.start_as_current_span(f"round_{round_count}") as span:
-                        span.set_attribute(
-                            SpanAttributes.INPUT_VALUE,
-                            self.game_state.model_dump_json(),
-                        )
-                        span.set_attribute(
-                            SpanAttributes.OPENINFERENCE_SPAN_KIND,
-                            OpenInferenceSpanKindValues.CHAIN.value,
-                        )
-                        print(
-                            f"\n\n\tGeneration {self.game_state.generation} Round {self.game_state.round}"
-                        )
-                        self.play_round()
-                        self.save_state()
-                if self.game_state.generation < self.game_state.generations:
-                    self.evolve()
+                self.collect_call_metrics()
+            for generation_count in range(
+                self.game_state.generation, self.game_state.generations
+            ):
+                with tracer.start_as_current_span(
+                    f"generation_{generation_count}"
+                ) as generation_span:
+                    self.start_generation(generation_span)
+                    for round_count in range(
+                        self.rounds_played, self.game_state.rounds
+                    ):
+                        with tracer.start_as_current_span(
+                            f"round_{round_count}"
+                        ) as span:
+                            self.start_round(span)
+                            await self.aplay_round()
+                            self.save_state()
+                            self.rounds_played += 1
+                            if self.round_checkpoint_due():
+                                self.save_checkpoint()
+                    self.finish_generation(generation_span)
+                    if self.rounds_since_snapshot:
+                        self.save_snapshot()
+                    if self.game_state.generation < self.game_state.generations:
+                        await self.aevolve()
+                        self.rounds_played = 0
+                        self.save_checkpoint()
+        finally:
+            # a failed round would otherwise leave threads and cluster workers behind
+            self.shutdown_workers()
 
+        self.remove_checkpoint()
         return self.players
+
+    def round_checkpoint_due(self) -> bool:
+        every = self.game_state.checkpoint_every
+        return every is not None and self.rounds_played % every == 0
+
+    def save_checkpoint(self):
+        """
+        Pickles the whole orchestrator (players, parents, history, decision table,
+        game state and RNG), so `resume` can continue from the last
+        checkpointed round or evolution.
+        """
+        if not self.game_state.checkpoint:
+            return
+        checkpoint = {
+            "orchestrator": self,
+            # rounds logged after this checkpoint are dropped again on resume
+            "run_log_size": self.run_log.size() if self.run_log else None,
+        }
+        os.makedirs(os.path.dirname(self.checkpoint_path), exist_ok=True)
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(checkpoint, f)
+        # a crash while writing never leaves a truncated checkpoint behind
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def remove_checkpoint(self):
+        # a run that doesn't checkpoint leaves those of other runs at the same path alone
+        if self.game_state.checkpoint and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    @classmethod
+    def resume(cls, path: str) -> "Orchestrator":
+        """Restores an orchestrator saved by `save_checkpoint`; call `run` or `arun` to continue."""
+        with open(path, "rb") as f:
+            checkpoint = pickle.load(f)
+        orchestrator: Orchestrator = checkpoint["orchestrator"]
+        if orchestrator.run_log and checkpoint["run_log_size"] is not None:
+            orchestrator.run_log.truncate(checkpoint["run_log_size"])
+        game_state = orchestrator.game_state
+        # calls made by the interrupted process after the checkpoint are lost with it
+        call_metrics.drain()
+        configure_cache(
+            mode=game_state.cache_mode,
+            path=game_state.cache_dir,
+            max_bytes=game_state.cache_max_bytes,
+        )
+        configure_parsing(
+            mode=game_state.output_mode,
+            retries=game_state.parse_retries,
+            repair=game_state.repair_outputs,
+        )
+        configure_client(
+            timeout=game_state.request_timeout, max_retries=game_state.max_retries
+        )
+        print(
+            f"\n\nResuming generation {game_state.generation} after {orchestrator.rounds_played} rounds"
+        )
+        return orchestrator
+
+    def start_generation(self, span):
+        set_lazy_attribute(
+            span,
+            SpanAttributes.INPUT_VALUE,
+            lambda: self.game_state.model_dump_json(),
+        )
+        span.set_attribute(
+            SpanAttributes.OPENINFERENCE_SPAN_KIND,
+            OpenInferenceSpanKindValues.CHAIN.value,
+        )
+        print(f"\n\nGeneration {self.game_state.generation}")
+
+    def finish_generation(self, span):
+        """Reports this generation's LLM calls, including how much of their prompts the provider served from its prefix cache."""
+        self.collect_call_metrics()
+        stats = summarize_calls(
+            [
+                record
+                for record in self.call_records
+                if record["generation"] == self.game_state.generation
+            ]
+        )
+        span.set_attribute("llm.calls", stats["calls"])
+        span.set_attribute("prompt_cache.cached_tokens", stats["cached_tokens"])
+        span.set_attribute("prompt_cache.prompt_tokens", stats["prompt_tokens"])
+        span.set_attribute("prompt_cache.ratio", stats["cached_token_ratio"])
+        span.set_attribute("llm.parse_failures", stats["parse_failures"])
+        span.set_attribute("llm.repaired", stats["repaired"])
+        if stats["calls"]:
+            latency = stats["latency"]
+            print(
+                f"\n\nGeneration {self.game_state.generation}: {stats['calls']} LLM calls, "
+                f"{stats['prompt_tokens']} prompt tokens ({stats['cached_token_ratio']:.0%} cached), "
+                f"{stats['completion_tokens']} completion tokens, ${stats['cost']:.4f}"
+                + (f", p95 latency {latency['p95']:.2f}s" if latency else "")
+                + (
+                    f", {stats['parse_failures']} unparsable replies"
+                    if stats["parse_failures"]
+                    else ""
+                )
+                + (
+                    f", {stats['repaired']} outputs repaired ({stats['repair_rate']:.0%}: "
+                    + ", ".join(f"{count} {repair}" for repair, count in stats["repairs"].items())
+                    + ")"
+                    if stats["repaired"]
+                    else ""
+                )
+            )
+
+    def collect_call_metrics(self):
+        """Moves the LLM calls recorded since the last collection into this run's records."""
+        game_state = self.game_state
+        for record in call_metrics.drain():
+            record["cost"] = call_cost(
+                record,
+                game_state.prompt_token_price,
+                game_state.completion_token_price,
+                game_state.cached_token_price,
+            )
+            self.call_records.append(record)
+
+    def metrics(self) -> dict:
+        """
+        Latency, queue wait, token, cost, retry, failure and repair summaries of this
+        run's LLM calls: in total, and per call kind (strategy, donation,
+        donation_batch), generation, round and player.
+        """
+        self.collect_call_metrics()
+        return {
+            "total": summarize_calls(self.call_records),
+            "by_kind": aggregate_calls(self.call_records, ["kind"]),
+            "by_generation": aggregate_calls(self.call_records, ["generation", "kind"]),
+            "by_round": aggregate_calls(self.call_records, ["generation", "round"]),
+            "by_player": aggregate_calls(self.call_records, ["player"]),
+        }
+
+    def save_metrics(self):
+        with open(os.path.splitext(self.save_path)[0] + "_metrics.json", "w") as f:
+            json.dump(self.metrics(), f)
+
+    def start_round(self, span):
+        set_lazy_attribute(
+            span,
+            SpanAttributes.INPUT_VALUE,
+            lambda: self.game_state.model_dump_json(),
+        )
+        span.set_attribute(
+            SpanAttributes.OPENINFERENCE_SPAN_KIND,
+            OpenInferenceSpanKindValues.CHAIN.value,
+        )
+        print(
+            f"\n\n\tGeneration {self.game_state.generation} Round {self.game_state.round}"
+        )
@@ -0,0 +1,83 @@
+import random
+from typing import Callable, Dict, List
+from models.config import GameState
+
+# (rng, number of players, game state) -> recipients[i] = index of the player donor i gives to
+Pairing = Callable[[random.Random, int, GameState], List[int]]
+
+
+def sample_derangement(rng: random.Random, n: int) -> List[int]:
+    """
+    Uniformly random derangement of range(n). A backwards Fisher-Yates shuffle
+    fixes position i for good once it is swapped, so the shuffle restarts as
+    soon as a fixed point appears. That is exact rejection sampling of uniform
+    permutations, and takes e restarts on average, each cut short early.
+    """
+    if n < 2:
+        raise ValueError("Pairing without self-donations needs at least 2 players")
+    while True:
+        perm = list(range(n))
+        for i in range(n - 1, -1, -1):
+            j = rng.randrange(i + 1)
+            perm[i], perm[j] = perm[j], perm[i]
+            if perm[i] == i:
+                break
+        else:
+            return perm
+
+
+def derangement_pairing(rng: random.Random, n: int, game_state: GameState) -> List[int]:
+    """Every player donates once and receives once, uniformly over all such pairings."""
+    return sample_derangement(rng, n)
+
+
+def cycle_pairing(rng: random.Random, n: int, game_state: GameState) -> List[int]:
+    """A uniformly random single cycle through all players (Sattolo's algorithm)."""
+    if n < 2:
+        raise ValueError("Pairing without self-donations needs at least 2 players")
+    perm = list(range(n))
+    for i in range(n - 1, 0, -1):
+        j = rng.randrange(i)
+        perm[i], perm[j] = perm[j], perm[i]
+    return perm
+
+
+def ring_pairing(rng: random.Random, n: int, game_state: GameState) -> List[int]:
+    """
+    Players sit in index order on a fixed ring and give to the player `step`
+    seats ahead, with the step advancing every round so partners rotate.
+    Deterministic, so it uses no randomness.
+    """
+    if n < 2:
+        raise ValueError("Pairing without self-donations needs at least 2 players")
+    step = 1 + game_state.round % (n - 1)
+    return [(i + step) % n for i in range(n)]
+
+
+def network_pairing(rng: random.Random, n: int, game_state: GameState) -> List[int]:
+    """
+    Players sit on a ring lattice where each is linked to the `pairing_degree`
+    nearest seats, and donate to a random neighbour. Unlike the other schemes
+    a player may receive several donations in a round, or none.
+    """
+    if n < 2:
+        raise ValueError("Pairing without self-donations needs at least 2 players")
+    reach = max(1, min(game_state.pairing_degree, n - 1) // 2)
+    offsets = [offset for distance in range(1, reach + 1) for offset in (distance, -distance)]
+    return [(i + rng.choice(offsets)) % n for i in range(n)]
+
+
+PAIRINGS: Dict[str, Pairing] = {
+    "derangement": derangement_pairing,
+    "cycle": cycle_pairing,
+    "ring": ring_pairing,
+    "network": network_pairing,
+}
+
+
+def get_pairing(game_state: GameState) -> Pairing:
+    if game_state.pairing not in PAIRINGS:
+        raise ValueError(
+            f"Unknown pairing {game_state.pairing}, expected one of {list(PAIRINGS)}"
+        )
+    return PAIRINGS[game_state.pairing]
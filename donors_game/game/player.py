@@ -1,13 +1,51 @@
-from models.config import GameState, Decision
-from models.signatures import StrategyBuilder, DonationBuilder
-from typing import List, Optional
-from utils.api import structured_generation_wrapper
-from utils.telemetry import tracer
+from models.config import GameState, Decision, DynamicGameState
+from models.decision_table import DecisionTable, DecisionView
+from models.signatures import StrategyBuilder, DonationBuilder, DonationBatchBuilder
+from typing import Dict, List, Optional, Tuple
+from game.policies import Policy, get_policy
+from utils.telemetry import tracer, set_lazy_attribute
+from utils.metrics import tag_calls, queued_since
 from openinference.semconv.trace import SpanAttributes, OpenInferenceSpanKindValues
 import json
+import time
+import asyncio
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from opentelemetry import context as context_api
 
 
+@lru_cache(maxsize=None)
+def rules_prompt(donation_multiplier: float) -> str:
+    return f"""Each player is given an initial endowment of 10 units of a resource.
+In each round, you are randomly paired with another individual.
+One of you is a donor, and the other is a recipient.
+The donor decides to give up some amount of the resource.
+The recipient receives {donation_multiplier}x the number of units that the donor gave up.
+If you were a donor in one round, you will be a recipient in the next round, and vice versa.
+Your goal is to maximize the number of units you have after the final round.
+After the game has finished, the best-performing half of agents will survive to the next generation, and continue playing."""
+
+
+@lru_cache(maxsize=None)
+def parents_prompt(
+    selection: str, cutoff_threshold: float, tournament_size: int, sampled: bool
+) -> str:
+    """Who the parents shown in a strategy prompt are, under the run's selection."""
+    share = f"{cutoff_threshold:.0%} of the previous generation"
+    if selection == "top_k":
+        pool = f"the best-performing {share}"
+    elif selection == "tournament":
+        pool = (
+            f"{share}, each the best-performing of {tournament_size} players "
+            "drawn at random"
+        )
+    elif selection == "roulette":
+        pool = f"{share}, picked with chances proportional to their final scores"
+    else:
+        raise ValueError(f"Unknown selection {selection}")
+    return f"a random sample of {pool}" if sampled else pool
+
+
 class Player:
     def __init__(
         self,
@@ -15,23 +53,117 @@ class Player:
         i: int,
         parents: List["Player"] = [],
         strategy: Optional[str] = None,
+        decision_table: Optional[DecisionTable] = None,
     ):
         self.name: str = f"{game_state.generation}_{i}"
         self.parents: List[Player] = parents
-        self.history: List[Decision] = []
+        # rows of the run's shared decision table, or of a private one for a standalone player
+        self.decision_table = decision_table if decision_table is not None else DecisionTable()
+        self.history: DecisionView = DecisionView(self.decision_table)
+        self.decisions_by_round: Dict[int, int] = {}
+        # this player's entry in the orchestrator's trace table, most recent round first
+        self.trace_lines: Tuple[str, ...] = ()
+        # (generation, donation_multiplier, strategy) -> static start of every donation prompt
+        self.prefix_cache: Dict[Tuple[int, float, str], str] = {}
         self.wallet: float = float(game_state.base_wallet)
-        if strategy:
+        self.policy: Policy = get_policy(game_state)
+        if strategy is not None:
             self.strategy: str = strategy
         else:
             self.strategy: str = self.generate_strategy(
                 game_state=game_state, parents=parents
             )
 
+    @classmethod
+    def spawn(
+        cls,
+        game_state: GameState,
+        count: int,
+        parents: List["Player"] = [],
+        decision_table: Optional[DecisionTable] = None,
+        child_parents: Optional[List[List["Player"]]] = None,
+    ) -> List["Player"]:
+        """
+        Creates players 0..count-1 of the current generation, generating their
+        strategies concurrently. Players are returned in index order.
+        `child_parents[i]`, if given, replaces `parents` for player i.
+        """
+        current_context = context_api.get_current()
+        with ThreadPoolExecutor(max_workers=game_state.max_concurrency) as executor:
+            futures = [
+                executor.submit(
+                    cls.setup_player,
+                    game_state,
+                    i,
+                    parents if child_parents is None else child_parents[i],
+                    decision_table,
+                    current_context,
+                    time.perf_counter(),
+                )
+                for i in range(count)
+            ]
+            return [future.result() for future in futures]
+
+    @classmethod
+    def setup_player(
+        cls,
+        game_state: GameState,
+        i: int,
+        parents: List["Player"],
+        decision_table: Optional[DecisionTable],
+        context: context_api.Context,
+        submitted_at: float,
+    ) -> "Player":
+        token = context_api.attach(context)
+        try:
+            with queued_since(submitted_at):
+                return cls(
+                    game_state=game_state,
+                    i=i,
+                    parents=parents,
+                    decision_table=decision_table,
+                )
+        finally:
+            context_api.detach(token)
+
+    @classmethod
+    async def aspawn(
+        cls,
+        game_state: GameState,
+        count: int,
+        parents: List["Player"] = [],
+        decision_table: Optional[DecisionTable] = None,
+        child_parents: Optional[List[List["Player"]]] = None,
+    ) -> List["Player"]:
+        """Async counterpart of `spawn`, generating all strategies on the event loop."""
+        players = [
+            cls(
+                game_state=game_state,
+                i=i,
+                parents=parents if child_parents is None else child_parents[i],
+                strategy="",
+                decision_table=decision_table,
+            )
+            for i in range(count)
+        ]
+        strategies = await asyncio.gather(
+            *[
+                player.agenerate_strategy(game_state=game_state, parents=player.parents)
+                for player in players
+            ]
+        )
+        for player, strategy in zip(players, strategies):
+            player.strategy = strategy
+        return players
+
     def find_decision_in_round(self, round_number: int) -> Decision:
-        for decision in self.history:
-            if decision.dynamic_game_state.round == round_number:
-                return decision
-        raise ValueError(f"Decision in round {round_number} not found")
+        if round_number not in self.decisions_by_round:
+            raise ValueError(f"Decision in round {round_number} not found")
+        return self.decision_table.decision(self.decisions_by_round[round_number])
+
+    def trace(self, depth: int) -> str:
+        """What this player and their earlier partners did in the last `depth` rounds, see `Orchestrator.update_traces`."""
+        return "".join(self.trace_lines[:depth])
 
     # def clone(self):
     #   player = Player(name=self.name, parents=self.parents, strategy=self.strategy)
@@ -39,25 +171,60 @@ class Player:
     #   player.history = self.history
     #   return player
 
+    def tag_calls(self, kind: str, game_state: GameState):
+        return tag_calls(
+            kind=kind,
+            player=self.name,
+            generation=game_state.generation,
+            round=game_state.round,
+        )
+
     def system_prompt(self, game_state: GameState):
-        return f"""Each player is given an initial endowment of 10 units of a resource.
-In each round, you are randomly paired with another individual.
-One of you is a donor, and the other is a recipient.
-The donor decides to give up some amount of the resource.
-The recipient receives {game_state.donation_multiplier}x the number of units that the donor gave up.
-If you were a donor in one round, you will be a recipient in the next round, and vice versa.
-Your goal is to maximize the number of units you have after the final round.
-After the game has finished, the best-performing half of agents will survive to the next generation, and continue playing."""
+        return rules_prompt(game_state.donation_multiplier)
+
+    def donation_prefix(self, game_state: GameState) -> str:
+        """
+        System prompt for donations: the shared rules followed by this player's
+        name and strategy. It is identical for every donation the player makes
+        in a generation, so providers with prefix caching only process it once.
+        """
+        key = (game_state.generation, game_state.donation_multiplier, self.strategy)
+        if key not in self.prefix_cache:
+            self.prefix_cache[key] = f"""{self.system_prompt(game_state=game_state)}
+
+Your name is {self.name}.
+As you will recall, here is the strategy you decided to follow: {self.strategy}
+This is generation {game_state.generation}.
+In each round you will be told who you have been paired with and what they and their earlier partners did, and you will take the role of donor."""
+        return self.prefix_cache[key]
+
+    def donation_prompt(self, game_state: GameState, recipient: "Player"):
+        """The per-round part of a donation prompt, kept after `donation_prefix`."""
+        trace = recipient.trace(game_state.trace_depth)
+
+        # TODO: donor is invisible to recipient
+        return f"""It is now round {game_state.round}.
+In this round, you have been paired with {recipient.name}.
+They currently have {recipient.wallet} units of the valuable resource.
+Here is what {recipient.name} and their earlier partners did in previous rounds: {trace}
+You currently have {self.wallet} units of the valuable resource.
+
+How many units do you give up? Very briefly think step by step about how you apply your strategy in this situation and then provide your answer."""
+
+    def parent_advice(self) -> str:
+        """How this player is shown to their children in the strategy prompt."""
+        return f"\n\n{self.name} with score {self.wallet} strategy: {self.strategy}"
 
-    def strategy_prompt(self, parents: List["Player"] = []):
+    def strategy_prompt(self, game_state: GameState, parents: List["Player"] = []):
         if parents:
-            parent_advice = "\n".join(
-                [
-                    f"\n\n{parent.name} with score {parent.wallet} strategy: {parent.strategy}"
-                    for parent in parents
-                ]
+            parent_advice = "\n".join([parent.parent_advice() for parent in parents])
+            described = parents_prompt(
+                game_state.selection,
+                game_state.cutoff_threshold,
+                game_state.tournament_size,
+                game_state.parents_per_child is not None,
             )
-            generation_prompt = f"""How would you approach the game? Here is the advice of the best-performing 50% of the previous generation, along with their final scores.
+            generation_prompt = f"""How would you approach the game? Here is the advice of {described}, along with their final scores.
 {parent_advice}
 Modify this advice to create your own strategy."""
         else:
@@ -84,114 +251,171 @@ In the first round, there will be no information about the recipient’s previou
 Before formulating your strategy, briefly think step by step about what would be a successful strategy in this game.
 Then describe your strategy briefly without explanation in one sentence that starts: My strategy will be."""
 
-    def donation_prompt(
-        self, game_state: GameState, recipient: "Player", players: List["Player"]
-    ):
-        def find_player(name: str) -> "Player":
-            for player in players:
-                if player.name == name:
-                    return player
-            raise ValueError(f"Player {name} not found")
-
-        def build_trace(depth: int):
-            trace = ""
-            current_recipient = recipient
-
-            for i in range(depth):
-                round_number = game_state.round - (i + 1)
-                if round_number < 1:
-                    break
-                recipient_decision = current_recipient.find_decision_in_round(
-                    round_number
-                )
-                trace += f"In round {round_number}, {current_recipient.name} donated {recipient_decision.donation_percent}% of their resources to {recipient_decision.recipient_name}.\n"
-                current_recipient: Player = find_player(
-                    recipient_decision.recipient_name
-                )
-            return trace
-
-        trace = build_trace(game_state.trace_depth)
-
-        # TODO: donor is invisible to recipient
-        return f"""Your name is 2_4.
-As you will recall, here is the strategy you decided to follow: {self.strategy}
-This is generation {game_state.generation}.
-It is now round {game_state.round}.
-In this round, you have been paired with {recipient.name}.
-They currently have {recipient.wallet} units of the valuable resource.
-Here is what {recipient.name} and their earlier partners did in previous rounds: {trace}
-You will take the role of donor. You currently have {self.wallet} units of the valuable resource.
-
-How many units do you give up? Very briefly think step by step about how you apply your strategy in this situation and then provide your answer."""
-
     def generate_strategy(
         self, game_state: GameState, parents: List["Player"] = []
     ) -> str:
-        with tracer.start_as_current_span("generate_strategy") as span:
+        with tracer.start_as_current_span("generate_strategy") as span, self.tag_calls(
+            "strategy", game_state
+        ):
             span.set_attribute(
                 SpanAttributes.OPENINFERENCE_SPAN_KIND,
                 OpenInferenceSpanKindValues.LLM.value,
             )
-            messages = [
-                {
-                    "role": "system",
-                    "content": self.system_prompt(game_state=game_state),
-                },
-                {"role": "user", "content": self.strategy_prompt(parents=parents)},
-            ]
-            args = {
-                "model": game_state.model_name,
-                "messages": messages,
-                "response_format": StrategyBuilder,
-            }
-            res = structured_generation_wrapper(**args)
-            built_strategy = StrategyBuilder.model_validate(res)
-
-            print(
-                f"\n\n{self.name} strategy:\n{built_strategy.model_dump_json(indent=2)}"
+            return self.policy.generate_strategy(self, game_state, parents)
+
+    async def agenerate_strategy(
+        self, game_state: GameState, parents: List["Player"] = []
+    ) -> str:
+        with tracer.start_as_current_span("generate_strategy") as span, self.tag_calls(
+            "strategy", game_state
+        ):
+            span.set_attribute(
+                SpanAttributes.OPENINFERENCE_SPAN_KIND,
+                OpenInferenceSpanKindValues.LLM.value,
             )
+            return await self.policy.agenerate_strategy(self, game_state, parents)
+
+    def strategy_args(self, game_state: GameState, parents: List["Player"] = []) -> dict:
+        messages = [
+            {
+                "role": "system",
+                "content": self.system_prompt(game_state=game_state),
+            },
+            {
+                "role": "user",
+                "content": self.strategy_prompt(game_state=game_state, parents=parents),
+            },
+        ]
+        return {
+            "model": game_state.model_name,
+            "messages": messages,
+            "response_format": StrategyBuilder,
+        }
+
+    def built_strategy(self, res) -> str:
+        built_strategy = StrategyBuilder.model_validate(res)
+
+        print(
+            f"\n\n{self.name} strategy:\n{built_strategy.model_dump_json(indent=2)}"
+        )
+
+        return built_strategy.strategy
 
-            return built_strategy.strategy
+    def generate_donation(self, game_state: GameState, recipient: "Player") -> float:
+        with tracer.start_as_current_span("generate_donation") as span, self.tag_calls(
+            "donation", game_state
+        ):
+            span.set_attribute(
+                SpanAttributes.OPENINFERENCE_SPAN_KIND,
+                OpenInferenceSpanKindValues.LLM.value,
+            )
+            return self.policy.generate_donation(self, game_state, recipient)
 
-    def generate_donation(
-        self, game_state: GameState, recipient: "Player", players: List["Player"]
+    async def agenerate_donation(
+        self, game_state: GameState, recipient: "Player"
     ) -> float:
-        with tracer.start_as_current_span("generate_donation") as span:
+        with tracer.start_as_current_span("generate_donation") as span, self.tag_calls(
+            "donation", game_state
+        ):
             span.set_attribute(
                 SpanAttributes.OPENINFERENCE_SPAN_KIND,
                 OpenInferenceSpanKindValues.LLM.value,
             )
-            messages = [
-                {
-                    "role": "system",
-                    "content": self.system_prompt(game_state=game_state),
-                },
-                {
-                    "role": "user",
-                    "content": self.donation_prompt(
-                        game_state=game_state, recipient=recipient, players=players
-                    ),
-                },
-            ]
-            args = {
-                "model": game_state.model_name,
-                "messages": messages,
-                "response_format": DonationBuilder,
-            }
-            res = structured_generation_wrapper(**args)
-            built_donation = DonationBuilder.model_validate(res)
-
-            print(
-                f"\n\n{self.name} donation:\n{built_donation.model_dump_json(indent=2)}"
+            return await self.policy.agenerate_donation(
+                self, game_state, recipient
             )
 
-            return built_donation.donation
+    def donation_args(self, game_state: GameState, recipient: "Player") -> dict:
+        messages = [
+            {
+                "role": "system",
+                "content": self.donation_prefix(game_state=game_state),
+            },
+            {
+                "role": "user",
+                "content": self.donation_prompt(
+                    game_state=game_state, recipient=recipient
+                ),
+            },
+        ]
+        return {
+            "model": game_state.model_name,
+            "messages": messages,
+            "response_format": DonationBuilder,
+        }
+
+    def built_donation(self, res) -> float:
+        built_donation = DonationBuilder.model_validate(res)
+
+        print(
+            f"\n\n{self.name} donation:\n{built_donation.model_dump_json(indent=2)}"
+        )
+
+        return built_donation.donation
+
+    @staticmethod
+    def donation_batch_prompt(
+        game_state: GameState,
+        pairs: List[Tuple["Player", "Player"]],
+    ) -> str:
+        donors = "\n\n".join(
+            f"""Donor {donor.name}:
+Strategy: {donor.strategy}
+{donor.name} has been paired with {recipient.name}, who currently has {recipient.wallet} units of the valuable resource.
+Here is what {recipient.name} and their earlier partners did in previous rounds: {recipient.trace(game_state.trace_depth)}
+{donor.name} currently has {donor.wallet} units of the valuable resource."""
+            for donor, recipient in pairs
+        )
+        return f"""You are deciding for several donors at once. Each donor follows their own strategy and only knows what is listed under their name.
+This is generation {game_state.generation}.
+It is now round {game_state.round}.
+
+{donors}
+
+How many units does each donor give up? Very briefly think step by step about how each donor applies their strategy in their situation and then provide exactly one donation per donor, with their name."""
+
+    @classmethod
+    def donation_batch_args(
+        cls,
+        game_state: GameState,
+        pairs: List[Tuple["Player", "Player"]],
+    ) -> dict:
+        """One request deciding the donations of every donor in `pairs`."""
+        messages = [
+            {
+                "role": "system",
+                "content": rules_prompt(game_state.donation_multiplier),
+            },
+            {
+                "role": "user",
+                "content": cls.donation_batch_prompt(game_state, pairs),
+            },
+        ]
+        return {
+            "model": game_state.model_name,
+            "messages": messages,
+            "response_format": DonationBatchBuilder,
+        }
+
+    @staticmethod
+    def built_donation_batch(
+        res, pairs: List[Tuple["Player", "Player"]]
+    ) -> List[Optional[float]]:
+        """Donation of each donor in `pairs`, None for donors the response left out."""
+        built_batch = DonationBatchBuilder.model_validate(res)
+
+        print(f"\n\nDonation batch:\n{built_batch.model_dump_json(indent=2)}")
+
+        donations = {}
+        for donation in built_batch.donations:
+            # the first answer counts if a donor is repeated
+            donations.setdefault(donation.donor_name, donation.donation)
+        return [donations.get(donor.name) for donor, _ in pairs]
 
     def setup_donation(
         self,
         recipient: "Player",
         game_state: GameState,
-        players: List["Player"],
         context: context_api.Context,
     ) -> Decision:
         token = context_api.attach(context)
@@ -201,42 +425,98 @@ How many units do you give up? Very briefly think step by step about how you app
                     SpanAttributes.OPENINFERENCE_SPAN_KIND,
                     OpenInferenceSpanKindValues.AGENT.value,
                 )
-                span.set_attribute(
-                    SpanAttributes.INPUT_VALUE, json.dumps(self.model_dump())
-                )
-                donation_percent = self.generate_donation(
-                    game_state, recipient, players
+                set_lazy_attribute(
+                    span,
+                    SpanAttributes.INPUT_VALUE,
+                    lambda: json.dumps(self.model_dump()),
                 )
-                donation_amount = self.wallet * donation_percent
-
-                # if the donor doesn't have enough funds, donate all of their funds
-                if self.wallet - donation_amount < 0:
-                    donation_amount = self.wallet
+                answer = self.generate_donation(game_state, recipient)
+                return self.answer_decision(span, recipient, game_state, answer)
+        finally:
+            context_api.detach(token)
 
-                span.set_attribute(
-                    SpanAttributes.OUTPUT_VALUE,
-                    json.dumps(
-                        {
-                            "donation_percent": donation_percent,
-                            "donation_amount": donation_amount,
-                        }
-                    ),
-                )
+    async def asetup_donation(
+        self,
+        recipient: "Player",
+        game_state: GameState,
+    ) -> Decision:
+        with tracer.start_as_current_span(f"execute_donation-{self.name}") as span:
+            span.set_attribute(
+                SpanAttributes.OPENINFERENCE_SPAN_KIND,
+                OpenInferenceSpanKindValues.AGENT.value,
+            )
+            set_lazy_attribute(
+                span,
+                SpanAttributes.INPUT_VALUE,
+                lambda: json.dumps(self.model_dump()),
+            )
+            answer = await self.agenerate_donation(game_state, recipient)
+            return self.answer_decision(span, recipient, game_state, answer)
+
+    def donation_share(self, answer: float, game_state: GameState) -> float:
+        """
+        The share of the wallet an answered donation stands for. Donors are
+        asked how many units they give up, so with `repair_outputs` an answer
+        above 1 is read as units (capped at the wallet) and a negative one as 0.
+        """
+        if not game_state.repair_outputs or 0 <= answer <= 1:
+            return answer
+        if answer < 0:
+            return 0.0
+        return min(answer / self.wallet, 1.0) if self.wallet > 0 else 1.0
+
+    def answer_decision(
+        self, span, recipient: "Player", game_state: GameState, answer: float
+    ) -> Decision:
+        """The decision for a policy's answer, keeping the answer itself if it was repaired."""
+        donation_percent = self.donation_share(answer, game_state)
+        return self.build_decision(
+            span,
+            recipient,
+            game_state,
+            donation_percent,
+            raw_donation_percent=answer if donation_percent != answer else None,
+        )
+
+    def build_decision(
+        self,
+        span,
+        recipient: "Player",
+        game_state: GameState,
+        donation_percent: float,
+        fallback: bool = False,
+        raw_donation_percent: Optional[float] = None,
+    ) -> Decision:
+        donation_amount = self.wallet * donation_percent
 
-                game_state_copy = GameState(**game_state.model_dump())
-                decision = Decision(
-                    donor_name=self.name,
-                    recipient_name=recipient.name,
-                    dynamic_game_state=game_state_copy,
-                    donation_percent=donation_percent,
-                    donation_amount=donation_amount,
-                    donor_wallet_before=self.wallet,
-                    donor_wallet_after=self.wallet - donation_amount,
-                )
+        # if the donor doesn't have enough funds, donate all of their funds
+        if self.wallet - donation_amount < 0:
+            donation_amount = self.wallet
 
-                return decision
-        finally:
-            context_api.detach(token)
+        set_lazy_attribute(
+            span,
+            SpanAttributes.OUTPUT_VALUE,
+            lambda: json.dumps(
+                {
+                    "donation_percent": donation_percent,
+                    "donation_amount": donation_amount,
+                }
+            ),
+        )
+
+        return Decision(
+            donor_name=self.name,
+            recipient_name=recipient.name,
+            dynamic_game_state=DynamicGameState(
+                generation=game_state.generation, round=game_state.round
+            ),
+            donation_percent=donation_percent,
+            donation_amount=donation_amount,
+            donor_wallet_before=self.wallet,
+            donor_wallet_after=self.wallet - donation_amount,
+            fallback=fallback,
+            raw_donation_percent=raw_donation_percent,
+        )
 
     def execute_donation(
         self, recipient: "Player", game_state: GameState, donation: Decision
@@ -244,17 +524,25 @@ How many units do you give up? Very briefly think step by step about how you app
         self.wallet -= donation.donation_amount
         recipient.wallet += donation.donation_amount * game_state.donation_multiplier
 
-        self.history.append(donation)
+        self.record_decision(donation)
+
+    def record_decision(self, donation: Decision):
+        row = self.decision_table.append(donation)
+        self.history.append_row(row)
+        self.decisions_by_round[donation.dynamic_game_state.round] = row
 
     # get current user information as a dict
-    def model_dump(self):
-        return {
+    def model_dump(self, with_history: bool = True):
+        data = {
             "name": self.name,
             "parents": [parent.name for parent in self.parents],
-            "history": [decision.model_dump() for decision in self.history],
+            "history": self.history.model_dump(),
             "wallet": self.wallet,
             "strategy": self.strategy,
         }
+        if not with_history:
+            del data["history"]
+        return data
 
     # function to make the player json serializable
     def __json__(self):
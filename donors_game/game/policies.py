@@ -0,0 +1,190 @@
+import asyncio
+import hashlib
+import json
+import time
+from typing import TYPE_CHECKING, List, Optional, Tuple
+from models.config import GameState
+from utils.api import structured_generation_wrapper, async_structured_generation_wrapper
+
+if TYPE_CHECKING:
+    from game.player import Player
+
+
+class Policy:
+    """
+    Decides a player's strategy and donations. The async methods fall back to
+    the sync ones, which is right for backends that never block on I/O.
+    """
+
+    def __init__(self, game_state: GameState):
+        self.game_state = game_state
+
+    def generate_strategy(
+        self, player: "Player", game_state: GameState, parents: List["Player"]
+    ) -> str:
+        raise NotImplementedError
+
+    def generate_donation(
+        self,
+        player: "Player",
+        game_state: GameState,
+        recipient: "Player",
+    ) -> float:
+        raise NotImplementedError
+
+    def generate_donation_batch(
+        self,
+        game_state: GameState,
+        pairs: List[Tuple["Player", "Player"]],
+    ) -> List[Optional[float]]:
+        """
+        Donations of every donor in `pairs` in one go, None where a donor is
+        left undecided. Backends without a batched call decide one by one.
+        """
+        return [
+            self.generate_donation(donor, game_state, recipient)
+            for donor, recipient in pairs
+        ]
+
+    async def agenerate_strategy(
+        self, player: "Player", game_state: GameState, parents: List["Player"]
+    ) -> str:
+        return self.generate_strategy(player, game_state, parents)
+
+    async def agenerate_donation(
+        self,
+        player: "Player",
+        game_state: GameState,
+        recipient: "Player",
+    ) -> float:
+        return self.generate_donation(player, game_state, recipient)
+
+    async def agenerate_donation_batch(
+        self,
+        game_state: GameState,
+        pairs: List[Tuple["Player", "Player"]],
+    ) -> List[Optional[float]]:
+        return self.generate_donation_batch(game_state, pairs)
+
+
+class LLMPolicy(Policy):
+    """Structured outputs from the OpenAI-compatible endpoint configured in utils.api."""
+
+    def generate_strategy(self, player, game_state, parents):
+        res = structured_generation_wrapper(
+            **player.strategy_args(game_state=game_state, parents=parents)
+        )
+        return player.built_strategy(res)
+
+    async def agenerate_strategy(self, player, game_state, parents):
+        res = await async_structured_generation_wrapper(
+            **player.strategy_args(game_state=game_state, parents=parents)
+        )
+        return player.built_strategy(res)
+
+    def generate_donation(self, player, game_state, recipient):
+        res = structured_generation_wrapper(
+            **player.donation_args(game_state, recipient)
+        )
+        return player.built_donation(res)
+
+    async def agenerate_donation(self, player, game_state, recipient):
+        res = await async_structured_generation_wrapper(
+            **player.donation_args(game_state, recipient)
+        )
+        return player.built_donation(res)
+
+    def generate_donation_batch(self, game_state, pairs):
+        donor = pairs[0][0]
+        res = structured_generation_wrapper(
+            **donor.donation_batch_args(game_state, pairs)
+        )
+        return donor.built_donation_batch(res, pairs)
+
+    async def agenerate_donation_batch(self, game_state, pairs):
+        donor = pairs[0][0]
+        res = await async_structured_generation_wrapper(
+            **donor.donation_batch_args(game_state, pairs)
+        )
+        return donor.built_donation_batch(res, pairs)
+
+
+class FixedPercentPolicy(Policy):
+    """Always donates `policy_percent` of the wallet."""
+
+    def generate_strategy(self, player, game_state, parents):
+        return f"My strategy will be to always donate {self.game_state.policy_percent} of my resources."
+
+    def generate_donation(self, player, game_state, recipient):
+        return self.game_state.policy_percent
+
+
+class TitForTatPolicy(Policy):
+    """
+    Donates what the recipient donated in the previous round, as shown first in
+    the trace, and `policy_percent` when there is nothing to go on.
+    """
+
+    def generate_strategy(self, player, game_state, parents):
+        return (
+            "My strategy will be to donate the same percentage the recipient donated in their last round, "
+            f"and {self.game_state.policy_percent} when I know nothing about them."
+        )
+
+    def generate_donation(self, player, game_state, recipient):
+        previous_round = game_state.round - 1
+        if game_state.trace_depth < 1 or previous_round < 1:
+            return self.game_state.policy_percent
+        try:
+            return recipient.find_decision_in_round(previous_round).donation_percent
+        except ValueError:
+            return self.game_state.policy_percent
+
+
+class LocalModelPolicy(Policy):
+    """
+    Stand-in for a local model. It builds the same prompts as the LLM backend
+    and answers with a deterministic pseudo-random output derived from a hash
+    of the messages, after an optional simulated `policy_latency`. This keeps
+    prompt construction and pacing realistic without any network.
+    """
+
+    def respond(self, args: dict) -> float:
+        digest = hashlib.sha256(json.dumps(args["messages"]).encode()).digest()
+        return int.from_bytes(digest[:8], "big") / 2**64
+
+    def strategy(self, player, game_state, parents) -> str:
+        value = self.respond(player.strategy_args(game_state=game_state, parents=parents))
+        return f"My strategy will be to donate around {value:.2f} of my resources."
+
+    def generate_strategy(self, player, game_state, parents):
+        time.sleep(self.game_state.policy_latency)
+        return self.strategy(player, game_state, parents)
+
+    async def agenerate_strategy(self, player, game_state, parents):
+        await asyncio.sleep(self.game_state.policy_latency)
+        return self.strategy(player, game_state, parents)
+
+    def generate_donation(self, player, game_state, recipient):
+        time.sleep(self.game_state.policy_latency)
+        return self.respond(player.donation_args(game_state, recipient))
+
+    async def agenerate_donation(self, player, game_state, recipient):
+        await asyncio.sleep(self.game_state.policy_latency)
+        return self.respond(player.donation_args(game_state, recipient))
+
+
+POLICIES = {
+    "llm": LLMPolicy,
+    "fixed": FixedPercentPolicy,
+    "tit_for_tat": TitForTatPolicy,
+    "local": LocalModelPolicy,
+}
+
+
+def get_policy(game_state: GameState) -> Policy:
+    if game_state.policy not in POLICIES:
+        raise ValueError(
+            f"Unknown policy {game_state.policy}, expected one of {list(POLICIES)}"
+        )
+    return POLICIES[game_state.policy](game_state)
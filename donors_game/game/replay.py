@@ -0,0 +1,180 @@
+import argparse
+import math
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+from models.config import GameState
+from models.decision_table import DecisionTable
+from game.orchestrator import Orchestrator
+from game.player import Player
+from utils.run_log import load_game_state
+from utils.telemetry import tracer
+
+
+class ReplayOrchestrator(Orchestrator):
+    """
+    Re-executes a saved run from its recorded strategies, pairings and donation
+    percentages without any LLM calls. Donation amounts and wallets are
+    recomputed by `Player.execute_donation`, so the replay reproduces the saved
+    wallets, and passing overrides (e.g. `donation_multiplier=3`) replays the
+    same decisions under different economics. Rosters and parents are taken
+    from the recording, so selection settings such as `cutoff_threshold` have
+    no effect.
+    """
+
+    def __init__(self, data: dict, **overrides):
+        config = {key: value for key, value in data.items() if key != "history"}
+        game_state = GameState(
+            **{
+                **config,
+                # replays never write over the recorded run
+                "persistence": "snapshot",
+                "cache_mode": "off",
+                "checkpoint": False,
+                **overrides,
+                "generation": 0,
+                "round": 0,
+            }
+        )
+        self.recorded_history: Dict[str, List[dict]] = data["history"]
+        game_state.generations = len(self.recorded_history)
+        self.recorded_decisions: Dict[Tuple[int, int], List[dict]] = defaultdict(list)
+        self.recorded_rounds: Dict[int, List[int]] = {}
+        for generation in range(game_state.generations):
+            rounds = set()
+            for player in self.recorded_history[f"g{generation}"]:
+                for decision in player["history"]:
+                    round_number = decision["dynamic_game_state"]["round"]
+                    rounds.add(round_number)
+                    self.recorded_decisions[(generation, round_number)].append(decision)
+            self.recorded_rounds[generation] = sorted(rounds)
+        game_state.rounds = max(
+            [len(rounds) for rounds in self.recorded_rounds.values()] + [0]
+        )
+
+        self.round_index = 0
+        # (generation, round, player, field, recorded, replayed)
+        self.mismatches: List[Tuple[int, int, str, str, float, float]] = []
+        self.final_wallets: Dict[str, Dict[str, float]] = {}
+        decision_table = DecisionTable()
+        super().__init__(
+            game_state,
+            players=self.recorded_players(game_state, {}, decision_table),
+            decision_table=decision_table,
+        )
+
+    def recorded_players(
+        self,
+        game_state: GameState,
+        previous: Dict[str, Player],
+        decision_table: DecisionTable,
+    ) -> List[Player]:
+        players = []
+        for recorded in self.recorded_history[f"g{game_state.generation}"]:
+            players.append(
+                Player(
+                    game_state=game_state,
+                    i=int(recorded["name"].split("_")[-1]),
+                    parents=[previous[name] for name in recorded["parents"] if name in previous],
+                    strategy=recorded["strategy"],
+                    decision_table=decision_table,
+                )
+            )
+        return players
+
+    def current_decisions(self) -> List[dict]:
+        return self.recorded_decisions[
+            (self.game_state.generation, self.game_state.round)
+        ]
+
+    def create_donor_recipient_pairs(self) -> List[Tuple[Player, Player]]:
+        return [
+            (self.find_player(decision["donor_name"]), self.find_player(decision["recipient_name"]))
+            for decision in self.current_decisions()
+        ]
+
+    def play_round(self):
+        rounds = self.recorded_rounds[self.game_state.generation]
+        if self.round_index >= len(rounds):
+            # the recording stopped part way through this generation
+            return
+        self.game_state.round = rounds[self.round_index]
+        self.round_index += 1
+        with tracer.start_as_current_span("play_round") as span:
+            pairs = self.setup_round(span)
+            results = [
+                donor.build_decision(
+                    span,
+                    recipient,
+                    self.game_state,
+                    recorded["donation_percent"],
+                    fallback=recorded.get("fallback", False),
+                    raw_donation_percent=recorded.get("raw_donation_percent"),
+                )
+                for (donor, recipient), recorded in zip(pairs, self.current_decisions())
+            ]
+            for result, recorded in zip(results, self.current_decisions()):
+                self.check(result.donor_name, "donor_wallet_before", recorded["donor_wallet_before"], result.donor_wallet_before)
+                self.check(result.donor_name, "donation_amount", recorded["donation_amount"], result.donation_amount)
+            self.finish_round(results)
+
+    def check(self, name: str, field: str, recorded: float, replayed: float):
+        if not math.isclose(recorded, replayed, rel_tol=1e-9, abs_tol=1e-9):
+            self.mismatches.append(
+                (self.game_state.generation, self.game_state.round, name, field, recorded, replayed)
+            )
+
+    def evolve(self):
+        generation_key = f"g{self.game_state.generation}"
+        self.final_wallets[generation_key] = {}
+        for recorded in self.recorded_history[generation_key]:
+            player = self.find_player(recorded["name"])
+            self.final_wallets[generation_key][player.name] = player.wallet
+            self.check(player.name, "wallet", recorded["wallet"], player.wallet)
+
+        if self.game_state.generation + 1 >= self.game_state.generations:
+            return
+        previous = {player.name: player for player in self.players}
+        self.game_state.generation += 1
+        self.game_state.round = 1
+        self.round_index = 0
+        self.players = self.recorded_players(
+            self.game_state, previous, self.decision_table
+        )
+
+    def save_state(self):
+        pass
+
+    @property
+    def reproduced(self) -> bool:
+        return not self.mismatches
+
+
+def replay(path: str, **overrides) -> ReplayOrchestrator:
+    """Replays a saved game_state.json (or .jsonl run log) and returns the finished orchestrator."""
+    orchestrator = ReplayOrchestrator(load_game_state(path), **overrides)
+    orchestrator.run()
+    return orchestrator
+
+
+if __name__ == "__main__":
+    # python -m game.replay ../data/gpt-4o-mini/g10_r12_p12/game_state.json --donation-multiplier 3
+    parser = argparse.ArgumentParser(description="Replay a saved run without LLM calls")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--donation-multiplier", type=float)
+    args = parser.parse_args()
+
+    overrides = {}
+    if args.donation_multiplier is not None:
+        overrides["donation_multiplier"] = args.donation_multiplier
+    for path in args.paths:
+        start = time.perf_counter()
+        orchestrator = replay(path, **overrides)
+        elapsed = time.perf_counter() - start
+        decisions = sum(len(decisions) for decisions in orchestrator.recorded_decisions.values())
+        print(
+            f"{path}: {decisions} decisions in {elapsed * 1000:.1f} ms, "
+            f"{'reproduced' if orchestrator.reproduced else f'{len(orchestrator.mismatches)} mismatches'}"
+        )
+        for generation_key, wallets in orchestrator.final_wallets.items():
+            print(f"\t{generation_key} total wallet {sum(wallets.values()):.2f}")
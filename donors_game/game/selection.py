@@ -0,0 +1,156 @@
+import heapq
+import random
+import re
+from typing import Callable, Dict, FrozenSet, Iterator, List, Optional
+from models.config import GameState
+from game.player import Player
+
+# (rng, players, game state) -> the parent pool, richest first
+Selection = Callable[[random.Random, List[Player], GameState], List[Player]]
+
+
+def pool_size(players: List[Player], game_state: GameState) -> int:
+    return int(len(players) * game_state.cutoff_threshold)
+
+
+def by_wallet(players: List[Player]) -> List[Player]:
+    return sorted(players, key=lambda player: player.wallet, reverse=True)
+
+
+def top_k_selection(
+    rng: random.Random, players: List[Player], game_state: GameState
+) -> List[Player]:
+    """The richest `cutoff_threshold` share of the players."""
+    return by_wallet(players)[: pool_size(players, game_state)]
+
+
+def tournament_selection(
+    rng: random.Random, players: List[Player], game_state: GameState
+) -> List[Player]:
+    """
+    Fills the pool with the richest of `tournament_size` players drawn at
+    random from those not yet selected. Weaker players get through now and
+    then, which keeps more strategies alive than top-k.
+    """
+    remaining = list(players)
+    pool = []
+    for _ in range(pool_size(players, game_state)):
+        contenders = rng.sample(
+            range(len(remaining)), min(game_state.tournament_size, len(remaining))
+        )
+        winner = max(contenders, key=lambda i: remaining[i].wallet)
+        pool.append(remaining[winner])
+        remaining[winner] = remaining[-1]
+        remaining.pop()
+    return by_wallet(pool)
+
+
+def roulette_selection(
+    rng: random.Random, players: List[Player], game_state: GameState
+) -> List[Player]:
+    """
+    Samples the pool without replacement with probabilities proportional to
+    wallets, using one random key per player (Efraimidis-Spirakis). Empty
+    wallets are only picked once everyone else is.
+    """
+    keys = [
+        rng.random() ** (1 / player.wallet) if player.wallet > 0 else -rng.random()
+        for player in players
+    ]
+    chosen = heapq.nlargest(
+        pool_size(players, game_state), range(len(players)), key=keys.__getitem__
+    )
+    return by_wallet([players[i] for i in chosen])
+
+
+SELECTIONS: Dict[str, Selection] = {
+    "top_k": top_k_selection,
+    "tournament": tournament_selection,
+    "roulette": roulette_selection,
+}
+
+
+def get_selection(game_state: GameState) -> Selection:
+    if game_state.selection not in SELECTIONS:
+        raise ValueError(
+            f"Unknown selection {game_state.selection}, expected one of {list(SELECTIONS)}"
+        )
+    return SELECTIONS[game_state.selection]
+
+
+def random_order(rng: random.Random, n: int) -> Iterator[int]:
+    """range(n) in uniformly random order, drawn lazily so taking k items costs O(k)."""
+    swapped: Dict[int, int] = {}
+    for i in range(n):
+        j = rng.randrange(i, n)
+        yield swapped.get(j, j)
+        swapped[j] = swapped.get(i, i)
+
+
+def strategy_words(strategy: str) -> FrozenSet[str]:
+    return frozenset(re.findall(r"\w+", strategy.lower()))
+
+
+def similarity(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    """Jaccard similarity of two strategies' word sets."""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def pick_parents(
+    pool: List[Player],
+    order: Iterator[int],
+    words: Optional[List[FrozenSet[str]]],
+    game_state: GameState,
+) -> List[Player]:
+    """
+    Takes parents from `pool` in `order` until `parents_per_child` are picked,
+    skipping near-duplicates of a picked strategy and stopping once the
+    advice would exceed `parent_advice_chars`. The first parent is always kept.
+    """
+    limit = game_state.parents_per_child or len(pool)
+    picked: List[int] = []
+    chars = 0
+    for i in order:
+        if len(picked) >= limit:
+            break
+        if words is not None and any(
+            similarity(words[i], words[j]) >= game_state.dedup_similarity
+            for j in picked
+        ):
+            continue
+        advice = len(pool[i].parent_advice())
+        if (
+            game_state.parent_advice_chars is not None
+            and picked
+            and chars + advice > game_state.parent_advice_chars
+        ):
+            break
+        picked.append(i)
+        chars += advice
+    # pool order, i.e. richest first
+    return [pool[i] for i in sorted(picked)]
+
+
+def parents_for_children(
+    rng: random.Random, pool: List[Player], count: int, game_state: GameState
+) -> List[List[Player]]:
+    """
+    The parents shown in each child's strategy prompt. Without
+    `parents_per_child` every child sees the same (deduplicated, budgeted)
+    pool, otherwise each child samples its own parents, so a prompt's length
+    doesn't grow with the population.
+    """
+    words = (
+        [strategy_words(parent.strategy) for parent in pool]
+        if game_state.dedup_similarity is not None
+        else None
+    )
+    if game_state.parents_per_child is None:
+        shared = pick_parents(pool, iter(range(len(pool))), words, game_state)
+        return [shared] * count
+    return [
+        pick_parents(pool, random_order(rng, len(pool)), words, game_state)
+        for _ in range(count)
+    ]
@@ -0,0 +1,121 @@
+import argparse
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+# the donors listed in a batched donation prompt (see Player.donation_batch_prompt)
+DONOR_PATTERN = re.compile(r"^Donor (\S+):$", re.M)
+# formats described in the system message by the "json" and "text" output modes
+TITLE_PATTERN = re.compile(r'"title": "(\w+Builder)"')
+
+
+def response_format_name(body: dict) -> Optional[str]:
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        return response_format["json_schema"]["name"]
+    match = TITLE_PATTERN.search(body["messages"][0]["content"])
+    return match.group(1) if match else None
+
+
+class MockLLM:
+    """
+    Answers chat completions like an OpenAI-compatible endpoint, with fixed
+    structured outputs. Batched donation replies leave out the last `missing`
+    donors, so the individual calls that make up for them are exercised too.
+    """
+
+    def __init__(self, donation: float = 0.5, missing: int = 1):
+        self.donation = donation
+        self.missing = missing
+        self.counts: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def output(self, name: str, prompt: str) -> dict:
+        if name == "StrategyBuilder":
+            return {
+                "thoughts": ["Cooperation pays off when others return it."],
+                "strategy": "My strategy will be to donate half of my resources.",
+            }
+        if name == "DonationBuilder":
+            return {"thoughts": ["I follow my strategy."], "donation": self.donation}
+        if name == "DonationBatchBuilder":
+            donors = DONOR_PATTERN.findall(prompt)
+            return {
+                "donations": [
+                    {"donor_name": donor, "thoughts": ["I follow my strategy."], "donation": self.donation}
+                    for donor in donors[: max(0, len(donors) - self.missing)]
+                ]
+            }
+        raise ValueError(f"Unknown response format {name}")
+
+    def completion(self, body: dict) -> dict:
+        name = response_format_name(body)
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+        content = json.dumps(self.output(name, body["messages"][-1]["content"]))
+        prompt_tokens = len(json.dumps(body["messages"])) // 4
+        completion_tokens = len(content) // 4
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body["model"],
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+
+def make_handler(llm: MockLLM):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, status: int, data):
+            payload = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            if not self.path.endswith("/chat/completions"):
+                return self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            try:
+                self.send_json(200, llm.completion(body))
+            except ValueError as e:
+                self.send_json(400, {"error": {"message": str(e)}})
+
+        def do_GET(self):
+            # calls per response format, e.g. to check that left out donors were asked individually
+            with llm.lock:
+                self.send_json(200, dict(llm.counts))
+
+    return Handler
+
+
+if __name__ == "__main__":
+    # python mock_server.py 8000
+    # then run with OPENAI_BASE_URL=http://127.0.0.1:8000/v1 OPENAI_API_KEY=mock
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock endpoint for offline runs")
+    parser.add_argument("port", type=int)
+    parser.add_argument("--donation", type=float, default=0.5, help="share every donor gives")
+    parser.add_argument("--missing", type=int, default=1, help="donors left out of each batched reply")
+    args = parser.parse_args()
+
+    llm = MockLLM(args.donation, args.missing)
+    print(f"Mock LLM listening on http://127.0.0.1:{args.port}/v1")
+    ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(llm)).serve_forever()
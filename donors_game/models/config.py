@@ -1,3 +1,4 @@
+from typing import Optional
 from pydantic import BaseModel
 
 
@@ -16,12 +17,116 @@ class GameConfig(BaseModel):
     cutoff_threshold: float = 0.5
     save_path: str = "game_state.json"
     model_name: str = "gpt-4o-mini"
+    # decision backend: "llm", "fixed", "tit_for_tat" or "local" (see game/policies.py)
+    policy: str = "llm"
+    # donation of the rule-based policies, and tit_for_tat's opening move
+    policy_percent: float = 0.5
+    # simulated response time of the "local" stand-in, in seconds
+    policy_latency: float = 0.0
+    # "threads" runs LLM calls on thread pools, "async" on one event loop with AsyncOpenAI,
+    # "distributed" sends each round's donations to workers through a broker (see game/distributed.py)
+    engine: str = "threads"
+    # host:port of the broker for the "distributed" engine, None starts a local one
+    # with `local_workers` worker processes
+    broker_address: Optional[str] = None
+    local_workers: int = 2
+    # upper bound on concurrent LLM calls when building players and playing rounds
+    max_concurrency: int = 16
+    # shared rate limits for the async engine, None for no limit
+    requests_per_minute: Optional[int] = None
+    tokens_per_minute: Optional[int] = None
+    # retries of calls that hit 429s, timeouts or connection errors, with either engine
+    max_retries: int = 5
+    # seconds before an LLM request is abandoned, with either engine
+    request_timeout: float = 60
+    # USD per million tokens, for the cost in the run's metrics; cached prompt
+    # tokens cost `cached_token_price` when set and the prompt price otherwise
+    prompt_token_price: float = 0.0
+    completion_token_price: float = 0.0
+    cached_token_price: Optional[float] = None
+    # seconds a donation call may take before `fallback` is used, None waits indefinitely
+    donation_deadline: Optional[float] = None
+    # once a donation call runs longer than this percentile of the run's earlier
+    # donation latencies, a duplicate request is sent and the first answer wins
+    hedge_percentile: Optional[float] = None
+    # donation of a donor whose call failed or missed the deadline: "raise" aborts
+    # the round, "zero" donates nothing, "repeat" repeats their last percentage
+    fallback: str = "raise"
+    # "native" uses OpenAI structured outputs, "json" (a JSON object response format)
+    # and "text" (no response format) put the schema in the system message and parse
+    # the reply locally, for models without structured-output support (see utils/parsing.py)
+    output_mode: str = "native"
+    # times a call whose reply couldn't be parsed is sent again, just that call
+    parse_retries: int = 2
+    # read donations above 1 as units of the donor's wallet and negative ones as 0;
+    # the answer itself is kept as the decision's raw_donation_percent
+    repair_outputs: bool = True
+    # "individual" asks for each donation separately, "batched" decides a round's
+    # donations in one call per `donation_batch_size` donors (None for the whole round)
+    donation_mode: str = "individual"
+    donation_batch_size: Optional[int] = None
+    # on-disk response cache: "off", "read_through", "write_through" or "replay"
+    cache_mode: str = "off"
+    cache_dir: str = "../data/.cache"
+    cache_max_bytes: int = 512 * 2**20
+    # "stream" appends each round to a .jsonl run log and only rewrites the
+    # full json snapshot every `snapshot_every` rounds, "snapshot" rewrites it every round
+    persistence: str = "stream"
+    snapshot_every: int = 12
+    # "columnar" writes one compact decision table next to the rosters (read it back
+    # with load_game_state), "json" the original layout with every decision inside its player
+    save_format: str = "columnar"
+    # pickle the run after every evolution, and every `checkpoint_every` rounds if set,
+    # so Orchestrator.resume can continue it; each checkpoint rewrites the whole run
+    checkpoint: bool = True
+    checkpoint_every: Optional[int] = None
+    # seed of the run's RNG (pairings, selection); None draws one, which is then saved with the run
+    seed: Optional[int] = None
+    # "derangement", "cycle", "ring" or "network" (see game/pairing.py)
+    pairing: str = "derangement"
+    # neighbours per player for the "network" pairing
+    pairing_degree: int = 4
+    # how evolve picks the parent pool (see game/selection.py): "top_k" keeps the richest
+    # cutoff_threshold share, "tournament" and "roulette" fill a pool of that size at random
+    selection: str = "top_k"
+    # players per tournament for the "tournament" selection
+    tournament_size: int = 3
+    # parents sampled from the pool for each child's strategy prompt, None shows the whole pool
+    parents_per_child: Optional[int] = None
+    # a parent whose strategy is at least this similar (word Jaccard) to one already shown is skipped
+    dedup_similarity: Optional[float] = None
+    # characters of parent advice per strategy prompt, None is unlimited
+    parent_advice_chars: Optional[int] = None
+    # appended to the g*_r*_p* directory so runs that only differ in other settings don't collide
+    run_tag: str = ""
 
 
 class GameState(GameConfig, DynamicGameState):
     pass
 
 
+class NumericGameConfig(BaseModel):
+    # reputation thresholds, on the softmax-squashed reputation in (-1, 1)
+    bad_reputation_thresh: float = -0.5
+    good_reputation_thresh: float = 0.5
+    donate_thresh: float = 0.0
+    # chance that a donation is multiplied by pos_sum_mult instead of passed on as is
+    prob_pos_sum: float = 0.3
+    pos_sum_mult: float = 3
+    reputation_update: float = 0.2
+    # cost of a donation to the donor
+    cost: float = 5
+    # each agent knows the recipient's reputation with probability ~ N(q, q_std)
+    q: float = 0.8
+    q_std: float = 0.1
+    base_wallet: float = 100
+    agents: int = 100
+    rounds: int = 100
+    # independent copies of the population simulated side by side
+    replicas: int = 1
+    seed: Optional[int] = None
+
+
 class Decision(BaseModel):
     # agents data
     recipient_name: str
@@ -34,6 +139,11 @@ class Decision(BaseModel):
     # donor wallet data
     donor_wallet_before: float
     donor_wallet_after: float
+    # the configured fallback was used because the model didn't answer in time or failed
+    fallback: bool = False
+    # the donation as answered, before `repair_outputs` put it into [0, 1];
+    # None (or equal to donation_percent) when it needed no repair
+    raw_donation_percent: Optional[float] = None
 
     class Config:
         arbitrary_types_allowed = True
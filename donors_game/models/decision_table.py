@@ -0,0 +1,144 @@
+from array import array
+from collections.abc import Sequence
+from typing import Dict, List, Optional
+from models.config import Decision, DynamicGameState
+
+
+class DecisionTable:
+    """
+    Column store holding every decision of a run. Player names are interned to
+    integer ids and each field is an `array`, so a stored decision costs a few
+    dozen bytes instead of a pydantic `Decision` with a nested game state.
+    """
+
+    COLUMNS = {
+        "donor_id": "l",
+        "recipient_id": "l",
+        "generation": "i",
+        "round": "i",
+        "donation_percent": "d",
+        "donation_amount": "d",
+        "donor_wallet_before": "d",
+        "donor_wallet_after": "d",
+        "fallback": "b",
+        "raw_donation_percent": "d",
+    }
+
+    def __init__(self):
+        self.names: List[str] = []
+        self.name_ids: Dict[str, int] = {}
+        self.columns: Dict[str, array] = {
+            column: array(typecode) for column, typecode in self.COLUMNS.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.columns["donor_id"])
+
+    def name_id(self, name: str) -> int:
+        if name not in self.name_ids:
+            self.name_ids[name] = len(self.names)
+            self.names.append(name)
+        return self.name_ids[name]
+
+    def append(self, decision: Decision) -> int:
+        row = len(self)
+        self.columns["donor_id"].append(self.name_id(decision.donor_name))
+        self.columns["recipient_id"].append(self.name_id(decision.recipient_name))
+        self.columns["generation"].append(decision.dynamic_game_state.generation)
+        self.columns["round"].append(decision.dynamic_game_state.round)
+        self.columns["donation_percent"].append(decision.donation_percent)
+        self.columns["donation_amount"].append(decision.donation_amount)
+        self.columns["donor_wallet_before"].append(decision.donor_wallet_before)
+        self.columns["donor_wallet_after"].append(decision.donor_wallet_after)
+        self.columns["fallback"].append(decision.fallback)
+        self.columns["raw_donation_percent"].append(
+            decision.donation_percent
+            if decision.raw_donation_percent is None
+            else decision.raw_donation_percent
+        )
+        return row
+
+    def raw_donation_percent(self, row: int) -> Optional[float]:
+        # stored as the percentage itself when nothing was repaired, but read back as None like in `Decision`
+        raw = self.columns["raw_donation_percent"][row]
+        return None if raw == self.columns["donation_percent"][row] else raw
+
+    def row_dump(self, row: int) -> dict:
+        """The row in the same layout as `Decision.model_dump()`."""
+        columns = self.columns
+        return {
+            "recipient_name": self.names[columns["recipient_id"][row]],
+            "donor_name": self.names[columns["donor_id"][row]],
+            "dynamic_game_state": {
+                "generation": columns["generation"][row],
+                "round": columns["round"][row],
+            },
+            "donation_percent": columns["donation_percent"][row],
+            "donation_amount": columns["donation_amount"][row],
+            "donor_wallet_before": columns["donor_wallet_before"][row],
+            "donor_wallet_after": columns["donor_wallet_after"][row],
+            "fallback": bool(columns["fallback"][row]),
+            "raw_donation_percent": self.raw_donation_percent(row),
+        }
+
+    def decision(self, row: int) -> Decision:
+        columns = self.columns
+        return Decision(
+            recipient_name=self.names[columns["recipient_id"][row]],
+            donor_name=self.names[columns["donor_id"][row]],
+            dynamic_game_state=DynamicGameState(
+                generation=columns["generation"][row], round=columns["round"][row]
+            ),
+            donation_percent=columns["donation_percent"][row],
+            donation_amount=columns["donation_amount"][row],
+            donor_wallet_before=columns["donor_wallet_before"][row],
+            donor_wallet_after=columns["donor_wallet_after"][row],
+            fallback=bool(columns["fallback"][row]),
+            raw_donation_percent=self.raw_donation_percent(row),
+        )
+
+    def model_dump(self) -> dict:
+        return {
+            "names": self.names,
+            "columns": {column: values.tolist() for column, values in self.columns.items()},
+        }
+
+    @classmethod
+    def model_validate(cls, data: dict) -> "DecisionTable":
+        table = cls()
+        for name in data["names"]:
+            table.name_id(name)
+        rows = len(data["columns"]["donor_id"])
+        # tables saved before a column existed get its zero value, or the
+        # percentage itself for the raw one, as nothing was repaired then
+        missing = {"raw_donation_percent": data["columns"]["donation_percent"]}
+        for column, typecode in cls.COLUMNS.items():
+            table.columns[column] = array(
+                typecode, data["columns"].get(column, missing.get(column, [0] * rows))
+            )
+        return table
+
+
+class DecisionView(Sequence):
+    """
+    One player's decisions: the rows they own in a shared DecisionTable.
+    `Decision` objects are only materialized when indexed or iterated.
+    """
+
+    def __init__(self, table: DecisionTable, rows: Optional[array] = None):
+        self.table = table
+        self.rows = rows if rows is not None else array("l")
+
+    def append_row(self, row: int):
+        self.rows.append(row)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.table.decision(row) for row in self.rows[index]]
+        return self.table.decision(self.rows[index])
+
+    def model_dump(self) -> List[dict]:
+        return [self.table.row_dump(row) for row in self.rows]
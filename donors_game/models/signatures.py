@@ -26,3 +26,26 @@ class DonationBuilder(BaseModel):
         ...,
         description="The percentage amount of resources to donate. MUST BE A FLOAT BETWEEN 0 AND 1.",
     )
+
+
+class DonorDonation(BaseModel):
+    """One donor's donation within a batch"""
+
+    donor_name: str = Field(..., description="The name of the donor making this donation.")
+    thoughts: List[str] = Field(
+        ...,
+        description="Briefly describe the donor's thought process for this donation. NO MORE THAN 2 THOUGHTS.",
+    )
+    donation: float = Field(
+        ...,
+        description="The percentage amount of resources to donate. MUST BE A FLOAT BETWEEN 0 AND 1.",
+    )
+
+
+class DonationBatchBuilder(BaseModel):
+    """Build the donation of every listed donor"""
+
+    donations: List[DonorDonation] = Field(
+        ...,
+        description="Exactly one donation per listed donor.",
+    )
@@ -0,0 +1,173 @@
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+from archive import ArchiveWriter
+from game.orchestrator import Orchestrator, checkpoint_path_for
+from models.config import GameState
+from utils.api import configure_llm_budget
+from utils.misc import sanitize_filename
+from utils.telemetry import tracer, flush_telemetry
+
+# already part of the g*_r*_p* layout, so they are left out of the run tag
+PATH_KEYS = ("generations", "rounds", "players", "model_name")
+
+
+def run_tag_for(point: dict, seed: Optional[int]) -> str:
+    parts = [
+        f"{key}{sanitize_filename(str(value))}"
+        for key, value in point.items()
+        if key not in PATH_KEYS
+    ]
+    if seed is not None:
+        parts.append(f"seed{seed}")
+    return "_".join(parts)
+
+
+def expand_grid(
+    base: dict, grid: Dict[str, list], seeds: List[Optional[int]]
+) -> List[dict]:
+    """
+    One job per combination of `grid` values and seed. Each job is a full
+    GameState config with a `run_tag` that makes its output directory unique.
+    """
+    names = list(grid)
+    jobs = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        point = dict(zip(names, values))
+        for seed in seeds:
+            jobs.append(
+                {
+                    **base,
+                    **point,
+                    "seed": seed,
+                    "run_tag": run_tag_for(point, seed),
+                    "save_path": "game_state.json",
+                }
+            )
+    return jobs
+
+
+def init_worker(budget):
+    configure_llm_budget(budget)
+
+
+def summarize(orchestrator: Orchestrator) -> List[dict]:
+    """Final total wallet and average donation percentage of each generation."""
+    percents: Dict[int, List[float]] = {}
+    columns = orchestrator.decision_table.columns
+    for generation, percent in zip(columns["generation"], columns["donation_percent"]):
+        percents.setdefault(generation, []).append(percent)
+    summary = []
+    for generation_key, players in orchestrator.history.items():
+        generation = int(generation_key[1:])
+        generation_percents = percents.get(generation, [])
+        summary.append(
+            {
+                "generation": generation,
+                "total_wallet": sum(player["wallet"] for player in players),
+                "average_donation_percent": (
+                    sum(generation_percents) / len(generation_percents)
+                    if generation_percents
+                    else None
+                ),
+            }
+        )
+    return summary
+
+
+def run_job(config: dict) -> dict:
+    """Runs one configuration to completion in a worker process, resuming its checkpoint if there is one."""
+    game_state = GameState(**config)
+    entry = {
+        "run_tag": game_state.run_tag,
+        "model_name": game_state.model_name,
+        "config": config,
+        "status": "done",
+    }
+    start = time.perf_counter()
+    with tracer.start_as_current_span(f"sweep_job-{game_state.run_tag}"):
+        try:
+            checkpoint_path = checkpoint_path_for(game_state)
+            if os.path.exists(checkpoint_path):
+                orchestrator = Orchestrator.resume(checkpoint_path)
+            else:
+                orchestrator = Orchestrator(game_state)
+            if game_state.engine == "async":
+                asyncio.run(orchestrator.arun())
+            else:
+                orchestrator.run()
+            entry["save_path"] = orchestrator.save_path
+            entry["generations"] = summarize(orchestrator)
+        except Exception as e:
+            # the checkpoint is kept, so rerunning the sweep picks this job up again
+            entry["status"] = "failed"
+            entry["error"] = repr(e)
+    entry["elapsed"] = time.perf_counter() - start
+    # pool workers exit without running atexit hooks
+    flush_telemetry()
+    return entry
+
+
+def run_sweep(
+    name: str,
+    base: dict,
+    grid: Dict[str, list],
+    seeds: List[Optional[int]] = [None],
+    processes: int = os.cpu_count() or 1,
+    llm_concurrency: int = 16,
+    archive: Optional[str] = None,
+) -> dict:
+    """
+    Runs every job of the grid on a process pool. At most `llm_concurrency`
+    LLM calls are in flight across all processes at any time. The summary
+    index is rewritten to ../data/sweeps/<name>.json as jobs finish, and
+    finished runs are appended to the `archive` directory if given.
+    """
+    jobs = expand_grid(base, grid, seeds)
+    index_path = f"../data/sweeps/{sanitize_filename(name)}.json"
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    index = {"name": name, "grid": grid, "seeds": seeds, "jobs": []}
+    # appended from this process only, as the archive takes one writer at a time
+    writer = ArchiveWriter(archive) if archive else None
+    # spawn, so workers don't inherit the parent's exporter threads and clients
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager:
+        budget = manager.BoundedSemaphore(llm_concurrency)
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=context,
+            initializer=init_worker,
+            initargs=(budget,),
+        ) as executor:
+            futures = [executor.submit(run_job, job) for job in jobs]
+            for future in as_completed(futures):
+                entry = future.result()
+                if writer and entry["status"] == "done":
+                    entry["archive_run"] = writer.add_run(entry["save_path"])
+                index["jobs"].append(entry)
+                print(
+                    f"[{len(index['jobs'])}/{len(jobs)}] {entry['model_name']} {entry['run_tag']}: "
+                    f"{entry['status']} in {entry['elapsed']:.1f}s"
+                )
+                with open(index_path, "w") as f:
+                    json.dump(index, f, indent=2)
+    return index
+
+
+if __name__ == "__main__":
+    # python sweep.py sweep.json
+    # {"name": "multiplier", "base": {"generations": 5}, "grid": {"donation_multiplier": [1.5, 2, 3]},
+    #  "seeds": [0, 1, 2], "processes": 8, "llm_concurrency": 32, "archive": "../data/archive"}
+    parser = argparse.ArgumentParser(description="Run a grid of GameState configs on a process pool")
+    parser.add_argument("spec")
+    args = parser.parse_args()
+
+    with open(args.spec, "r") as f:
+        spec = json.load(f)
+    run_sweep(**spec)
@@ -1,36 +1,398 @@
+import asyncio
 import json
-import openai
 import os
+import threading
+import time
+from contextlib import nullcontext
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, Optional, Tuple
 from opentelemetry import trace
 from openinference.semconv.trace import SpanAttributes
 from dotenv import load_dotenv
+from utils.rate_limit import AsyncRateLimiter, backoff_delay
+from utils.cache import ResponseCache
+from utils.metrics import call_metrics
+from utils.parsing import OutputParseError, check_output, json_instruction, parse_output
+from utils.telemetry import set_lazy_attribute
+
+if TYPE_CHECKING:
+    import openai
 
 load_dotenv()
 
+# The openai SDK takes most of a second to import, so it is only loaded (and
+# the credentials checked) once the first client is needed.
+client: Optional["openai.OpenAI"] = None
+client_lock = threading.Lock()
+# seconds before a sync request is abandoned, so a hung call frees its thread
+client_timeout: float = 60
+# transient errors are retried in structured_generation_wrapper rather than by the
+# SDK, so each retry is counted and backs off outside the LLM budget
+client_max_retries = 2
+
+
+def api_settings() -> tuple:
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("Missing OPENAI_API_KEY")
+    return api_key, os.getenv("OPENAI_BASE_URL")
+
+
+def get_client() -> "openai.OpenAI":
+    """The sync client shared by every thread, created on first use."""
+    global client
+    if client is None:
+        with client_lock:
+            if client is None:
+                import openai
+
+                api_key, base_url = api_settings()
+                client = openai.OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    timeout=client_timeout,
+                    max_retries=0,
+                )
+    return client
+
+
+def configure_client(timeout: float = 60, max_retries: int = 2):
+    """Sets the sync client's request timeout, rebuilding it on next use if that changed, and its retries."""
+    global client, client_timeout, client_max_retries
+    with client_lock:
+        client_max_retries = max_retries
+        if timeout != client_timeout:
+            client_timeout = timeout
+            client = None
+
+
+@lru_cache(maxsize=None)
+def retryable_errors() -> tuple:
+    import openai
+
+    return (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+    )
+
+
+@lru_cache(maxsize=None)
+def parse_errors() -> tuple:
+    """Errors raised when the response arrived but couldn't be parsed into the response format."""
+    import openai
+    import pydantic
+
+    return (
+        openai.LengthFinishReasonError,
+        openai.ContentFilterFinishReasonError,
+        pydantic.ValidationError,
+        OutputParseError,
+    )
+
+
+# rough allowance for the structured response when estimating a call's tokens
+COMPLETION_TOKENS_ESTIMATE = 256
+
+async_client: Optional["openai.AsyncOpenAI"] = None
+async_semaphore: Optional[asyncio.Semaphore] = None
+async_rate_limiter: Optional[AsyncRateLimiter] = None
+async_max_retries = 5
+response_cache: Optional[ResponseCache] = None
+# semaphore shared with other processes (see sweep.py), held for the duration of each LLM call
+llm_budget = None
+# how replies are requested and checked, see configure_parsing
+OUTPUT_MODES = ("native", "json", "text")
+output_mode = "native"
+parse_retries = 0
+repair_outputs = False
+
+
+def set_usage_attributes(span, usage):
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    span.set_attribute(SpanAttributes.LLM_TOKEN_COUNT_PROMPT, usage.prompt_tokens)
+    span.set_attribute(SpanAttributes.LLM_TOKEN_COUNT_COMPLETION, usage.completion_tokens)
+    span.set_attribute(SpanAttributes.LLM_TOKEN_COUNT_TOTAL, usage.total_tokens)
+    span.set_attribute(
+        SpanAttributes.LLM_TOKEN_COUNT_PROMPT_DETAILS_CACHE_READ,
+        (getattr(details, "cached_tokens", None) or 0) if details else 0,
+    )
+
+
+def configure_cache(mode: str, path: str, max_bytes: int):
+    """Enables the on-disk response cache for every structured call, "off" disables it."""
+    global response_cache
+    response_cache = None if mode == "off" else ResponseCache(path, mode, max_bytes)
+
+
+def configure_parsing(mode: str = "native", retries: int = 0, repair: bool = False):
+    """
+    "native" asks for OpenAI structured outputs, "json" for a plain JSON
+    object and "text" for free text with the schema in the system message,
+    for local models without structured-output support; both are validated
+    locally. A call whose reply can't be parsed is sent again up to `retries`
+    times, and with `repair` out-of-range donations are reported as repairs
+    (the players repair them, see Player.donation_share).
+    """
+    global output_mode, parse_retries, repair_outputs
+    if mode not in OUTPUT_MODES:
+        raise ValueError(f"Unknown output mode {mode}, expected one of {list(OUTPUT_MODES)}")
+    output_mode, parse_retries, repair_outputs = mode, retries, repair
+
+
+def configure_llm_budget(budget):
+    """
+    Caps LLM calls across processes with a semaphore proxy, e.g. from
+    `multiprocessing.Manager().BoundedSemaphore(n)`. None removes the cap.
+    """
+    global llm_budget
+    llm_budget = budget
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise ValueError("Missing OPENAI_API_KEY")
 
-OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
+def configure_async_client(
+    max_concurrency: int,
+    requests_per_minute: Optional[int] = None,
+    tokens_per_minute: Optional[int] = None,
+    max_retries: int = 5,
+    timeout: float = 60,
+):
+    """
+    Sets up the AsyncOpenAI client, concurrency cap and rate limiter shared by
+    every async LLM call. Must be called from inside the running event loop.
+    """
+    global async_client, async_semaphore, async_rate_limiter, async_max_retries
+    import openai
 
-if OPENAI_BASE_URL:
-    client = openai.OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
-else:
-    client = openai.OpenAI(api_key=OPENAI_API_KEY)
+    api_key, base_url = api_settings()
+    # retries are handled here so they also go through the rate limiter
+    async_client = openai.AsyncOpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        max_retries=0,
+        timeout=timeout,
+    )
+    async_semaphore = asyncio.Semaphore(max_concurrency)
+    async_rate_limiter = AsyncRateLimiter(requests_per_minute, tokens_per_minute)
+    async_max_retries = max_retries
+
+
+def estimate_tokens(messages: list) -> int:
+    # ~4 characters per token is close enough for budgeting
+    return len(json.dumps(messages)) // 4 + COMPLETION_TOKENS_ESTIMATE
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def args_to_log(kwargs: dict) -> str:
+    return json.dumps(
+        {
+            **kwargs,
+            "response_format": kwargs["response_format"].model_json_schema(),
+        }
+    )
+
+
+def request_args(kwargs: dict) -> dict:
+    """The chat completion args for `output_mode`, which outside "native" carry the response format in the system message."""
+    if output_mode == "native":
+        return kwargs
+    messages = list(kwargs["messages"])
+    instruction = json_instruction(kwargs["response_format"])
+    # appended to the system message so its prefix stays cacheable
+    if messages and messages[0]["role"] == "system":
+        messages[0] = {**messages[0], "content": f"{messages[0]['content']}\n\n{instruction}"}
+    else:
+        messages.insert(0, {"role": "system", "content": instruction})
+    args = {key: value for key, value in kwargs.items() if key != "response_format"}
+    args["messages"] = messages
+    if output_mode == "json":
+        args["response_format"] = {"type": "json_object"}
+    return args
+
+
+def request(client, kwargs: dict):
+    """Sends a structured call with the sync or async client (the latter returns a coroutine)."""
+    if output_mode == "native":
+        return client.beta.chat.completions.parse(**kwargs)
+    return client.chat.completions.create(**request_args(kwargs))
+
+
+def parsed_output(res, kwargs: dict) -> Tuple[dict, List[str]]:
+    """The validated output of a response and the repairs it needed, out-of-range ones only with `repair_outputs`."""
+    message = res.choices[0].message
+    if output_mode == "native":
+        so, repairs = message.parsed, []
+        if not so:
+            raise OutputParseError("No response from LLM")
+    else:
+        so, repairs = parse_output(kwargs["response_format"], message.content or "")
+    # a non-finite donation is a parse failure either way
+    out_of_range = check_output(so)
+    if repair_outputs:
+        repairs += out_of_range
+    return so, repairs
+
+
+def cached_output(span, kwargs: dict):
+    cached = response_cache.lookup(kwargs) if response_cache else None
+    if cached is not None:
+        repairs = check_output(cached) if repair_outputs else []
+        set_lazy_attribute(span, SpanAttributes.OUTPUT_VALUE, lambda: cached.model_dump_json())
+        call_metrics.record(kwargs["model"], cache_hit=True, repairs=repairs)
+    return cached
+
+
+def sync_request(kwargs: dict, timing: dict):
+    """
+    A request through the LLM budget, retrying transient errors with
+    backoff. `timing` gets its latency, queue wait and retries.
+    """
+    for attempt in range(client_max_retries + 1):
+        timing["retries"] = attempt
+        waited = time.perf_counter()
+        with llm_budget or nullcontext():
+            requested = time.perf_counter()
+            timing["queue_wait"] += requested - waited
+            try:
+                return request(get_client(), kwargs)
+            except retryable_errors() as e:
+                if attempt == client_max_retries:
+                    raise
+                delay = backoff_delay(attempt, retry_after(e))
+            finally:
+                timing["latency"] += time.perf_counter() - requested
+        time.sleep(delay)
 
 
 def structured_generation_wrapper(*args, **kwargs) -> dict:
     # sleep(.1)
     span = trace.get_current_span()
-    args_to_log = {
-        **kwargs,
-        "response_format": kwargs["response_format"].model_json_schema(),
-    }
-    span.set_attribute(SpanAttributes.INPUT_VALUE, json.dumps(args_to_log))
-    res = client.beta.chat.completions.parse(**kwargs)
-    span.set_attribute(SpanAttributes.OUTPUT_VALUE, res.model_dump_json())
-    so = res.choices[0].message.parsed
-    if not so:
-        raise ValueError("No response from LLM")
+    set_lazy_attribute(span, SpanAttributes.INPUT_VALUE, lambda: args_to_log(kwargs))
+    cached = cached_output(span, kwargs)
+    if cached is not None:
+        return cached
+    # only a call whose reply couldn't be parsed is sent again, each attempt is its own record
+    for attempt in range(parse_retries + 1):
+        # latency sums the requests of every retry, queue_wait everything before them
+        timing = {"latency": 0.0, "queue_wait": 0.0, "retries": 0}
+        res = None
+        try:
+            res = sync_request(kwargs, timing)
+            so, repairs = parsed_output(res, kwargs)
+        except parse_errors():
+            call_metrics.record(
+                kwargs["model"], usage=res.usage if res else None, parse_failure=True, **timing
+            )
+            if attempt == parse_retries:
+                raise
+            continue
+        except Exception:
+            call_metrics.record(kwargs["model"], error=True, **timing)
+            raise
+        break
+    set_lazy_attribute(span, SpanAttributes.OUTPUT_VALUE, lambda: res.model_dump_json())
+    set_usage_attributes(span, res.usage)
+    call_metrics.record(kwargs["model"], usage=res.usage, repairs=repairs, **timing)
+    if response_cache:
+        response_cache.store(kwargs, so)
+    return so
+
+
+async def async_parse(kwargs: dict, timing: dict):
+    """One request, adding the wait for the LLM budget and the request's wall time to `timing`."""
+    start = time.perf_counter()
+    budget = llm_budget
+    if budget:
+        # the proxy blocks, so wait for it off the event loop
+        acquiring = asyncio.ensure_future(asyncio.to_thread(budget.acquire))
+        try:
+            await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # a deadline or a hedge winner cancelled us, but the thread still
+            # takes the permit, so hand it back once it has
+            def release(done):
+                if not done.cancelled() and done.exception() is None:
+                    budget.release()
+
+            acquiring.add_done_callback(release)
+            raise
+    requested = time.perf_counter()
+    timing["queue_wait"] += requested - start
+    try:
+        return await request(async_client, kwargs)
+    finally:
+        timing["latency"] += time.perf_counter() - requested
+        if budget:
+            budget.release()
+
+
+async def async_request(kwargs: dict, estimated_tokens: int, timing: dict):
+    """
+    A request through the concurrency cap and rate limiter, retrying
+    transient errors. `timing` gets its latency, queue wait and retries.
+    """
+    waited = time.perf_counter()
+    async with async_semaphore:
+        timing["queue_wait"] += time.perf_counter() - waited
+        for attempt in range(async_max_retries + 1):
+            timing["retries"] = attempt
+            waited = time.perf_counter()
+            await async_rate_limiter.acquire(estimated_tokens)
+            timing["queue_wait"] += time.perf_counter() - waited
+            try:
+                res = await async_parse(kwargs, timing)
+            except retryable_errors() as e:
+                async_rate_limiter.settle(estimated_tokens, 0)
+                if attempt == async_max_retries:
+                    raise
+                await asyncio.sleep(backoff_delay(attempt, retry_after(e)))
+                continue
+            if res.usage:
+                async_rate_limiter.settle(estimated_tokens, res.usage.total_tokens)
+            return res
+
+
+async def async_structured_generation_wrapper(*args, **kwargs) -> dict:
+    if async_client is None:
+        raise RuntimeError("Call configure_async_client before making async calls")
+    span = trace.get_current_span()
+    set_lazy_attribute(span, SpanAttributes.INPUT_VALUE, lambda: args_to_log(kwargs))
+    cached = cached_output(span, kwargs)
+    if cached is not None:
+        return cached
+    estimated_tokens = estimate_tokens(kwargs["messages"])
+    for attempt in range(parse_retries + 1):
+        # latency sums the requests of every retry, queue_wait everything before them
+        timing = {"latency": 0.0, "queue_wait": 0.0, "retries": 0}
+        res = None
+        try:
+            res = await async_request(kwargs, estimated_tokens, timing)
+            so, repairs = parsed_output(res, kwargs)
+        except parse_errors():
+            call_metrics.record(
+                kwargs["model"], usage=res.usage if res else None, parse_failure=True, **timing
+            )
+            if attempt == parse_retries:
+                raise
+            continue
+        except Exception:
+            call_metrics.record(kwargs["model"], error=True, **timing)
+            raise
+        break
+    set_lazy_attribute(span, SpanAttributes.OUTPUT_VALUE, lambda: res.model_dump_json())
+    set_usage_attributes(span, res.usage)
+    call_metrics.record(kwargs["model"], usage=res.usage, repairs=repairs, **timing)
+    if response_cache:
+        response_cache.store(kwargs, so)
     return so
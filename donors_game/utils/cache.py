@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Optional
+from pydantic import BaseModel
+
+
+# processes of a sweep may share a cache directory, so each one rescans its size
+# after writing this share of `max_bytes` to account for the others' entries
+RESCAN_SHARE = 0.05
+
+
+class CacheMiss(Exception):
+    pass
+
+
+class ResponseCache:
+    """
+    On-disk cache of parsed structured outputs, keyed by a hash of the request
+    (model, messages, response_format schema and any other call arguments).
+    Entries are json files whose mtime is bumped on every hit, so evicting the
+    oldest files once the cache outgrows `max_bytes` is an LRU.
+
+    Modes:
+      - "read_through": serve hits, call the model on misses and store the result
+      - "write_through": always call the model and store the result, refreshing the cache
+      - "replay": serve hits and raise CacheMiss on misses, never touching the network
+    """
+
+    MODES = ("read_through", "write_through", "replay")
+
+    def __init__(self, path: str, mode: str = "read_through", max_bytes: int = 512 * 2**20):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown cache mode {mode}, expected one of {self.MODES}")
+        self.path = path
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+        self.size = self.scan_size()
+        # bytes this process wrote since the last scan
+        self.unscanned = 0
+
+    def key(self, kwargs: dict) -> str:
+        response_format = kwargs["response_format"]
+        request = {
+            **kwargs,
+            "response_format": {
+                "name": response_format.__name__,
+                "schema": response_format.model_json_schema(),
+            },
+        }
+        encoded = json.dumps(request, sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], f"{key}.json")
+
+    def entries(self):
+        for root, _, files in os.walk(self.path):
+            for file in files:
+                if file.endswith(".json"):
+                    file_path = os.path.join(root, file)
+                    try:
+                        stat = os.stat(file_path)
+                    except FileNotFoundError:
+                        # evicted by another process
+                        continue
+                    yield file_path, stat.st_mtime, stat.st_size
+
+    def scan_size(self) -> int:
+        return sum(size for _, _, size in self.entries())
+
+    def lookup(self, kwargs: dict) -> Optional[BaseModel]:
+        if self.mode == "write_through":
+            return None
+        file_path = self.entry_path(self.key(kwargs))
+        try:
+            with open(file_path, "r") as f:
+                entry = json.load(f)
+            os.utime(file_path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            if self.mode == "replay":
+                raise CacheMiss(f"No cached response for request {self.key(kwargs)}")
+            return None
+        return kwargs["response_format"].model_validate(entry["parsed"])
+
+    def store(self, kwargs: dict, parsed: BaseModel):
+        key = self.key(kwargs)
+        file_path = self.entry_path(key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        encoded = json.dumps(
+            {
+                "response_format": kwargs["response_format"].__name__,
+                "parsed": parsed.model_dump(),
+            }
+        )
+        # write to a temporary file first so concurrent readers never see a partial entry
+        tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(encoded)
+        with self.lock:
+            previous_size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+            os.replace(tmp_path, file_path)
+            self.size += len(encoded) - previous_size
+            self.unscanned += len(encoded)
+            if self.size > self.max_bytes or self.unscanned > self.max_bytes * RESCAN_SHARE:
+                self.size = self.scan_size()
+                self.unscanned = 0
+                if self.size > self.max_bytes:
+                    self.evict()
+
+    def evict(self):
+        # drop the least recently used entries until the cache is back to 90% of its budget
+        target = self.max_bytes * 0.9
+        for file_path, _, size in sorted(self.entries(), key=lambda entry: entry[1]):
+            if self.size <= target:
+                break
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                continue
+            self.size -= size
@@ -0,0 +1,204 @@
+import contextvars
+import math
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence
+
+# what the current LLM call is for, set by the game code around each call
+call_tags: contextvars.ContextVar[Dict] = contextvars.ContextVar("call_tags", default={})
+# collects the records of calls made in a `capture_calls` block instead of the log
+call_sink: contextvars.ContextVar[Optional[List[dict]]] = contextvars.ContextVar(
+    "call_sink", default=None
+)
+# seconds the current task waited for an executor thread, added to its first call's queue_wait
+executor_wait: contextvars.ContextVar[float] = contextvars.ContextVar(
+    "executor_wait", default=0.0
+)
+
+SUMMED = (
+    "prompt_tokens",
+    "completion_tokens",
+    "cached_tokens",
+    "retries",
+    "parse_failures",
+    "repaired",
+    "errors",
+    "cache_hits",
+    "cost",
+)
+
+
+@contextmanager
+def tag_calls(**tags):
+    """Tags every LLM call made inside the block, e.g. `tag_calls(kind="donation", player="1_3")`."""
+    token = call_tags.set({**call_tags.get(), **tags})
+    try:
+        yield
+    finally:
+        call_tags.reset(token)
+
+
+@contextmanager
+def capture_calls():
+    """Yields a list that receives the records of the LLM calls made inside the block, e.g. on a worker."""
+    records: List[dict] = []
+    token = call_sink.set(records)
+    try:
+        yield records
+    finally:
+        call_sink.reset(token)
+
+
+@contextmanager
+def queued_since(submitted: float):
+    """Counts the time since `submitted`, when the block's task was handed to an executor, as queue wait."""
+    token = executor_wait.set(time.perf_counter() - submitted)
+    try:
+        yield
+    finally:
+        executor_wait.reset(token)
+
+
+class CallMetricsLog:
+    """
+    Per-call metrics of every LLM call in this process, as flat dicts:
+      - tags from `tag_calls` (kind, player, generation, round) and the model
+      - latency: wall time of the request(s) in seconds, queue_wait: time spent
+        waiting for an executor thread, the concurrency cap, rate limiter or LLM budget
+      - prompt/completion/cached tokens, retries, parse_failures, errors, cache_hits
+      - repaired: whether the output needed repairs (see utils/parsing.py), and
+        repairs: which ones, e.g. ["extracted_json", "percent"]
+    The orchestrator drains them after every round and generation.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records: List[dict] = []
+
+    def record(
+        self,
+        model: str,
+        latency: float = 0.0,
+        queue_wait: float = 0.0,
+        usage=None,
+        retries: int = 0,
+        parse_failure: bool = False,
+        error: bool = False,
+        cache_hit: bool = False,
+        repairs: Sequence[str] = (),
+    ):
+        details = getattr(usage, "prompt_tokens_details", None)
+        # the executor wait is only counted once, by the task's first call
+        queue_wait += executor_wait.get()
+        executor_wait.set(0.0)
+        record = {
+            "kind": None,
+            "player": None,
+            "generation": None,
+            "round": None,
+            **call_tags.get(),
+            "model": model,
+            "latency": latency,
+            "queue_wait": queue_wait,
+            "prompt_tokens": usage.prompt_tokens if usage else 0,
+            "completion_tokens": usage.completion_tokens if usage else 0,
+            "cached_tokens": (getattr(details, "cached_tokens", None) or 0) if details else 0,
+            "retries": retries,
+            "parse_failures": int(parse_failure),
+            "errors": int(error),
+            "cache_hits": int(cache_hit),
+            "repaired": int(bool(repairs)),
+            "repairs": list(repairs),
+        }
+        sink = call_sink.get()
+        if sink is not None:
+            sink.append(record)
+            return
+        with self.lock:
+            self.records.append(record)
+
+    def extend(self, records: List[dict]):
+        """Adds records of calls made elsewhere, e.g. by distributed workers."""
+        with self.lock:
+            self.records.extend(records)
+
+    def drain(self) -> List[dict]:
+        with self.lock:
+            records, self.records = self.records, []
+        return records
+
+
+call_metrics = CallMetricsLog()
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def summarize_calls(records: List[dict]) -> dict:
+    latencies = sorted(record["latency"] for record in records if not record["cache_hits"])
+    queue_waits = [record["queue_wait"] for record in records]
+    summary = {"calls": len(records)}
+    for field in SUMMED:
+        summary[field] = sum(record.get(field, 0) for record in records)
+    summary["cached_token_ratio"] = (
+        summary["cached_tokens"] / summary["prompt_tokens"]
+        if summary["prompt_tokens"]
+        else 0.0
+    )
+    # every failed parse is its own call record, retried by the wrapper
+    requested = summary["calls"] - summary["cache_hits"]
+    summary["parse_failure_rate"] = summary["parse_failures"] / requested if requested else 0.0
+    answered = summary["calls"] - summary["parse_failures"] - summary["errors"]
+    summary["repair_rate"] = summary["repaired"] / answered if answered else 0.0
+    summary["repairs"] = dict(
+        Counter(repair for record in records for repair in record.get("repairs", ()))
+    )
+    summary["latency"] = (
+        {
+            "mean": sum(latencies) / len(latencies),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1],
+        }
+        if latencies
+        else None
+    )
+    summary["queue_wait"] = (
+        {"mean": sum(queue_waits) / len(queue_waits), "max": max(queue_waits)}
+        if queue_waits
+        else None
+    )
+    return summary
+
+
+def aggregate_calls(records: List[dict], keys: Sequence[str]) -> List[dict]:
+    """One summary per distinct combination of `keys`, in order of first appearance."""
+    groups: Dict[tuple, List[dict]] = {}
+    for record in records:
+        groups.setdefault(tuple(record.get(key) for key in keys), []).append(record)
+    return [
+        {**dict(zip(keys, group)), **summarize_calls(group_records)}
+        for group, group_records in groups.items()
+    ]
+
+
+def call_cost(
+    record: dict,
+    prompt_price: float,
+    completion_price: float,
+    cached_price: Optional[float] = None,
+) -> float:
+    """Cost of a call with prices per million tokens; cached prompt tokens default to the prompt price."""
+    if cached_price is None:
+        cached_price = prompt_price
+    uncached = record["prompt_tokens"] - record["cached_tokens"]
+    return (
+        uncached * prompt_price
+        + record["cached_tokens"] * cached_price
+        + record["completion_tokens"] * completion_price
+    ) / 1e6
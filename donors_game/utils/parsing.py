@@ -0,0 +1,90 @@
+import json
+import math
+import re
+from typing import Iterator, List, Tuple, Type
+from pydantic import BaseModel, ValidationError
+
+# fields holding a share of the donor's resources, which must lie in [0, 1]
+PERCENT_FIELDS = ("donation",)
+FENCED_BLOCK = re.compile(r"```(?:json)?\s*(.*?)```", re.S)
+
+
+class OutputParseError(ValueError):
+    """The reply couldn't be turned into the response format, even after repairs."""
+
+
+def json_instruction(response_format: Type[BaseModel]) -> str:
+    schema = json.dumps(response_format.model_json_schema())
+    return f"Reply with only a JSON object matching this JSON schema:\n{schema}"
+
+
+def json_objects(text: str) -> Iterator[dict]:
+    """JSON objects embedded in free text: fenced blocks first, then from every `{` of the text, outermost first."""
+    decoder = json.JSONDecoder()
+    for block in FENCED_BLOCK.findall(text) + [text]:
+        for match in re.finditer(r"\{", block):
+            try:
+                value, _ = decoder.raw_decode(block, match.start())
+            except json.JSONDecodeError:
+                continue
+            if isinstance(value, dict):
+                yield value
+
+
+def parse_output(
+    response_format: Type[BaseModel], content: str
+) -> Tuple[BaseModel, List[str]]:
+    """
+    Validates a plain-text reply against the response format. A reply that
+    is exactly the JSON object takes the fast path through pydantic's JSON
+    parser, otherwise the first embedded object that validates is used.
+    Returns the output and the repairs that were needed.
+    """
+    try:
+        return response_format.model_validate_json(content), []
+    except ValidationError as e:
+        error = e
+    for value in json_objects(content):
+        try:
+            return response_format.model_validate(value), ["extracted_json"]
+        except ValidationError as e:
+            error = e
+    raise OutputParseError(
+        f"Reply doesn't match {response_format.__name__}: {error}"
+    )
+
+
+def check_percent(value: float) -> str:
+    """
+    Rejects non-finite values and names what is wrong with an out-of-range
+    one: "units" above 1 (donors are asked how many units they give up),
+    "negative" below 0, and "" if nothing is.
+    """
+    if not math.isfinite(value):
+        raise OutputParseError(f"Donation is {value}")
+    if value > 1:
+        return "units"
+    if value < 0:
+        return "negative"
+    return ""
+
+
+def check_output(output: BaseModel) -> List[str]:
+    """
+    Checks the percent fields of `output` and its nested models, returning
+    the repairs they need. Values are left as answered: only the player
+    knows the wallet that units are relative to (see Player.donation_share).
+    """
+    repairs = []
+    for name, value in output:
+        if name in PERCENT_FIELDS and isinstance(value, (int, float)):
+            repair = check_percent(value)
+            if repair:
+                repairs.append(repair)
+        elif isinstance(value, BaseModel):
+            repairs += check_output(value)
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, BaseModel):
+                    repairs += check_output(item)
+    return repairs
@@ -0,0 +1,80 @@
+import asyncio
+import random
+import time
+from typing import Optional
+
+
+class AsyncRateLimiter:
+    """
+    Token buckets for requests per minute and tokens per minute, shared by every
+    LLM call running on the event loop. A limit of None disables that bucket.
+    Token usage is estimated before the call and corrected with `settle` once
+    the response reports the real usage.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.available_requests = float(requests_per_minute or 0)
+        self.available_tokens = float(tokens_per_minute or 0)
+        self.last_refill = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        elapsed_minutes = (now - self.last_refill) / 60
+        self.last_refill = now
+        if self.requests_per_minute:
+            self.available_requests = min(
+                self.requests_per_minute,
+                self.available_requests + elapsed_minutes * self.requests_per_minute,
+            )
+        if self.tokens_per_minute:
+            self.available_tokens = min(
+                self.tokens_per_minute,
+                self.available_tokens + elapsed_minutes * self.tokens_per_minute,
+            )
+
+    def wait_time(self, tokens: int) -> float:
+        wait = 0.0
+        if self.requests_per_minute and self.available_requests < 1:
+            wait = max(
+                wait, (1 - self.available_requests) / self.requests_per_minute * 60
+            )
+        if self.tokens_per_minute:
+            # a single request larger than the whole bucket only waits for a full bucket
+            needed = min(tokens, self.tokens_per_minute)
+            if self.available_tokens < needed:
+                wait = max(
+                    wait, (needed - self.available_tokens) / self.tokens_per_minute * 60
+                )
+        return wait
+
+    async def acquire(self, tokens: int):
+        # the lock keeps waiters in FIFO order so large requests are not starved
+        async with self.lock:
+            while True:
+                self.refill()
+                wait = self.wait_time(tokens)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            if self.requests_per_minute:
+                self.available_requests -= 1
+            if self.tokens_per_minute:
+                self.available_tokens -= tokens
+
+    def settle(self, estimated_tokens: int, actual_tokens: int):
+        if self.tokens_per_minute:
+            self.available_tokens += estimated_tokens - actual_tokens
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Exponential backoff with full jitter, honoring a server supplied Retry-After."""
+    if retry_after is not None:
+        return retry_after
+    return random.uniform(0, min(60.0, 2.0**attempt))
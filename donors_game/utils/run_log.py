@@ -0,0 +1,151 @@
+import json
+import os
+from typing import Dict, List
+
+
+class RunLog:
+    """
+    Append-only JSONL log of a run. Every line is one record:
+      - {"type": "config", "game_state": {...}} written once when the run starts
+      - {"type": "roster", "generation": g, "players": [...]} once per generation
+      - {"type": "round", "state": {...}, "decisions": [...], "wallets": {...}} once per round
+    Appending a round costs the size of that round only, unlike rewriting the
+    whole history. `load_game_state` folds the records back into the
+    game_state.json layout.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def start(self, game_state: dict):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w") as f:
+            f.write(json.dumps({"type": "config", "game_state": game_state}) + "\n")
+
+    def size(self) -> int:
+        return os.path.getsize(self.path)
+
+    def truncate(self, size: int):
+        with open(self.path, "r+") as f:
+            f.truncate(size)
+
+    def append(self, record: dict):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def log_roster(self, generation: int, players: List[dict]):
+        self.append(
+            {
+                "type": "roster",
+                "generation": generation,
+                "players": [
+                    {
+                        "name": player["name"],
+                        "parents": player["parents"],
+                        "strategy": player["strategy"],
+                    }
+                    for player in players
+                ],
+            }
+        )
+
+    def log_round(self, state: dict, decisions: List[dict], wallets: Dict[str, float]):
+        self.append(
+            {
+                "type": "round",
+                "state": state,
+                "decisions": decisions,
+                "wallets": wallets,
+            }
+        )
+
+
+def fold_run_log(path: str) -> dict:
+    """Rebuild the game_state.json layout from a run log."""
+    data = {}
+    history = {}
+    players_by_name = {}
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record["type"] == "config":
+                data = dict(record["game_state"])
+            elif record["type"] == "roster":
+                generation_players = []
+                for player in record["players"]:
+                    player_data = {
+                        "name": player["name"],
+                        "parents": player["parents"],
+                        "history": [],
+                        "wallet": float(data.get("base_wallet", 10)),
+                        "strategy": player["strategy"],
+                    }
+                    players_by_name[player["name"]] = player_data
+                    generation_players.append(player_data)
+                history[f"g{record['generation']}"] = generation_players
+            elif record["type"] == "round":
+                for decision in record["decisions"]:
+                    players_by_name[decision["donor_name"]]["history"].append(decision)
+                for name, wallet in record["wallets"].items():
+                    players_by_name[name]["wallet"] = wallet
+                data.update(record["state"])
+    data["history"] = history
+    return data
+
+
+def expand_decisions(data: dict) -> dict:
+    """Rebuild per-player histories from a columnar snapshot's decision table."""
+    table = data.pop("decisions")
+    names = table["names"]
+    columns = table["columns"]
+    histories = {}
+    # the percentage itself when nothing was repaired
+    raw_percents = columns.get("raw_donation_percent", columns["donation_percent"])
+    for row in range(len(columns["donor_id"])):
+        donor_name = names[columns["donor_id"][row]]
+        histories.setdefault(donor_name, []).append(
+            {
+                "recipient_name": names[columns["recipient_id"][row]],
+                "donor_name": donor_name,
+                "dynamic_game_state": {
+                    "generation": columns["generation"][row],
+                    "round": columns["round"][row],
+                },
+                "donation_percent": columns["donation_percent"][row],
+                "donation_amount": columns["donation_amount"][row],
+                "donor_wallet_before": columns["donor_wallet_before"][row],
+                "donor_wallet_after": columns["donor_wallet_after"][row],
+                "fallback": bool(columns["fallback"][row]) if "fallback" in columns else False,
+                "raw_donation_percent": raw_percents[row]
+                if raw_percents[row] != columns["donation_percent"][row]
+                else None,
+            }
+        )
+    for generation_key, players in data["history"].items():
+        data["history"][generation_key] = [
+            {
+                "name": player["name"],
+                "parents": player["parents"],
+                "history": histories.get(player["name"], []),
+                "wallet": player["wallet"],
+                "strategy": player["strategy"],
+            }
+            for player in players
+        ]
+    return data
+
+
+def load_game_state(path: str) -> dict:
+    """
+    Load a saved run in the game_state.json layout, from either a json
+    snapshot (plain or columnar) or a .jsonl run log.
+    """
+    if path.endswith(".jsonl"):
+        return fold_run_log(path)
+    with open(path, "r") as f:
+        data = json.load(f)
+    if "decisions" in data:
+        data = expand_decisions(data)
+    return data
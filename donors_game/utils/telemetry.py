@@ -1,41 +1,122 @@
 import os
-from phoenix.otel import register
-from openinference.semconv.resource import ResourceAttributes
+import threading
+import warnings
+from typing import Callable, Optional
 from opentelemetry import trace
-from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
-from opentelemetry.sdk.resources import Resource
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import SimpleSpanProcessor
-
-
-OTEL_EXPORTER_OTLP_HEADERS = os.getenv("OTEL_EXPORTER_OTLP_HEADERS")
-PHOENIX_CLIENT_HEADERS = os.getenv("PHOENIX_CLIENT_HEADERS")
-PHOENIX_COLLECTOR_ENDPOINT = os.getenv("PHOENIX_COLLECTOR_ENDPOINT")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
-if (
-    not OTEL_EXPORTER_OTLP_HEADERS
-    or not PHOENIX_CLIENT_HEADERS
-    or not PHOENIX_COLLECTOR_ENDPOINT
-    or not OPENAI_API_KEY
-):
-    raise ValueError("Missing required environment variables")
+from dotenv import load_dotenv
 
-endpoint = PHOENIX_COLLECTOR_ENDPOINT + "/v1/traces"
+load_dotenv()
 
 project_name = "donors_game"
 
-tracer_provider = register(project_name=project_name, endpoint=endpoint)
+telemetry_configured = False
+telemetry_lock = threading.Lock()
+
+
+class LazyTracer:
+    """
+    Configures telemetry from the environment when the first span starts, so
+    importing the package doesn't load the exporters. Spans are resolved
+    through the global tracer provider, so they follow whatever
+    `configure_telemetry` installs. With no provider (telemetry off) they are
+    the API's non-recording no-ops.
+    """
+
+    def __init__(self, name: str):
+        self.tracer = trace.get_tracer(name)
+
+    def start_as_current_span(self, *args, **kwargs):
+        ensure_telemetry()
+        return self.tracer.start_as_current_span(*args, **kwargs)
+
+    def start_span(self, *args, **kwargs):
+        ensure_telemetry()
+        return self.tracer.start_span(*args, **kwargs)
+
+
+tracer = LazyTracer(__name__)
+
+
+def ensure_telemetry():
+    if not telemetry_configured:
+        with telemetry_lock:
+            if not telemetry_configured:
+                configure_telemetry()
+
+
+def configure_telemetry(
+    mode: Optional[str] = None,
+    sample_ratio: Optional[float] = None,
+    max_attribute_length: Optional[int] = None,
+    batch: Optional[bool] = None,
+):
+    """
+    Installs the tracer provider, otherwise done from the environment when the
+    first span starts. Arguments default to environment variables:
+      - mode (DONORS_GAME_TELEMETRY): "phoenix" exports OTLP/HTTP to
+        PHOENIX_COLLECTOR_ENDPOINT, "off" records nothing. Defaults to "phoenix"
+        when the endpoint is set and "off" otherwise.
+      - sample_ratio (DONORS_GAME_TRACE_SAMPLE_RATIO): fraction of traces kept, default 1.
+      - max_attribute_length (DONORS_GAME_TRACE_MAX_ATTRIBUTE_LENGTH): longer
+        attribute values are truncated, default 32768 characters.
+      - batch (DONORS_GAME_TRACE_BATCH): export spans from a background thread
+        in batches instead of synchronously as each span ends, default on.
+    """
+    global telemetry_configured
+    telemetry_configured = True
+    endpoint = os.getenv("PHOENIX_COLLECTOR_ENDPOINT")
+    if mode is None:
+        mode = os.getenv("DONORS_GAME_TELEMETRY", "phoenix" if endpoint else "off")
+    if mode == "off":
+        return
+    if mode != "phoenix":
+        raise ValueError(f"Unknown telemetry mode {mode}, expected 'phoenix' or 'off'")
+    if not endpoint:
+        warnings.warn("PHOENIX_COLLECTOR_ENDPOINT is not set, telemetry is disabled")
+        return
+    if sample_ratio is None:
+        sample_ratio = float(os.getenv("DONORS_GAME_TRACE_SAMPLE_RATIO", "1"))
+    if max_attribute_length is None:
+        max_attribute_length = int(
+            os.getenv("DONORS_GAME_TRACE_MAX_ATTRIBUTE_LENGTH", "32768")
+        )
+    if batch is None:
+        batch = os.getenv("DONORS_GAME_TRACE_BATCH", "1") != "0"
+
+    from openinference.semconv.resource import ResourceAttributes
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+        OTLPSpanExporter,
+    )
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import SpanLimits, TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, SimpleSpanProcessor
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+    resource = Resource(attributes={ResourceAttributes.PROJECT_NAME: project_name})
+    tracer_provider = TracerProvider(
+        resource=resource,
+        # children follow their root's decision so sampled traces stay complete
+        sampler=ParentBased(TraceIdRatioBased(sample_ratio)),
+        span_limits=SpanLimits(max_attribute_length=max_attribute_length),
+    )
+    # headers are read from OTEL_EXPORTER_OTLP_HEADERS
+    span_exporter = OTLPSpanExporter(endpoint=endpoint + "/v1/traces")
+    if batch:
+        span_processor = BatchSpanProcessor(span_exporter)
+    else:
+        span_processor = SimpleSpanProcessor(span_exporter)
+    tracer_provider.add_span_processor(span_processor)
+    trace.set_tracer_provider(tracer_provider)
+
 
+def set_lazy_attribute(span, key: str, value: Callable[[], str]):
+    """Sets an attribute whose value is only computed (e.g. serialized) when the span is recorded."""
+    if span.is_recording():
+        span.set_attribute(key, value())
 
-resource = Resource(attributes={ResourceAttributes.PROJECT_NAME: project_name})
 
-tracer_provider = TracerProvider(resource=resource)
-trace.set_tracer_provider(tracer_provider=tracer_provider)
-tracer = trace.get_tracer(__name__)
-span_exporter = OTLPSpanExporter(endpoint=endpoint)
-simple_span_processor = SimpleSpanProcessor(span_exporter=span_exporter)
-trace.get_tracer_provider().add_span_processor(simple_span_processor)
-# tracer_provider.add_span_processor(simple_span_processor)
-# trace.set_tracer_provider(tracer_provider)
-# tracer = trace.get_tracer(__name__)
+def flush_telemetry():
+    """Exports buffered spans now, for processes that exit without running atexit hooks."""
+    provider = trace.get_tracer_provider()
+    if hasattr(provider, "force_flush"):
+        provider.force_flush()